@@ -1,24 +1,24 @@
 import streamlit as st
 import json
-import requests
-import tiktoken
-from openai import OpenAI
 import os
 from dotenv import load_dotenv
 import bcrypt
-import pandas as pd
-from fuzzywuzzy import process
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
-import docx2txt
-import PyPDF2
-import csv
-import io
-import re
-import concurrent.futures
-import httpx
+import time
 import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from document_index import DocumentIndex, SentenceIndex
+from embedding_cache import EmbeddingCache
+from corpus_index import CorpusIndex
+from document_reader import read_document, spool_upload
+from job_queue import CANCELLED, DONE, FAILED, get_job_queue
+from keyword_index import open_keyword_embeddings, open_keyword_index
+from llm_scheduler import BULK, INTERACTIVE, request_context
+from section_routing import SectionRouter
+from conversation import make_message, pack_history
+from llm_transport import get_response_cache
+from metrics import metrics
+from summary_pipeline import MODEL, SECTION_INSTRUCTIONS, tokenizer, build_guided_prompt, build_summary_prompt, count_tokens, get_model_response
 
 st.set_page_config(
     page_title="Regulatory Bulletin Assistant",
@@ -26,31 +26,22 @@ st.set_page_config(
     layout="wide"
 )
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
 logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv('.env', override=True)
 
-# Initialize tokenizer
-tokenizer = tiktoken.encoding_for_model("gpt-3.5-turbo")
-
-# Initialize OpenAI client
-http_client = httpx.Client(verify=False)
-client = OpenAI(
-    base_url='https://opensource-challenger-api.prdlvgpu1.aiaccel.dell.com/v1',
-    http_client=http_client,
-    api_key=os.environ["CHALLENGER_GENAI_API_KEY"]
-)
-
-API_KEY=os.environ["CHALLENGER_GENAI_API_KEY"]
-
 # Constants
-MAX_FILE_SIZE = 5 * 1024 * 1024  # 5 MB
-MODEL = "llama-3-8b-instruct"
-MAX_OUTPUT_TOKENS = 4000
-MAX_TOKENS = 8192  # Maximum tokens for the model
-BUFFER_TOKENS = 50  # Buffer for system message and other overhead
+MAX_FILE_SIZE = int(os.environ.get("MAX_UPLOAD_MB", "200")) * 1024 * 1024  # Matches Streamlit's default server.maxUploadSize
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", ".cache/embeddings")
+EMBEDDING_CACHE_MAX_MB = int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "512"))
+EMBEDDING_CACHE_DTYPE = os.environ.get("EMBEDDING_CACHE_DTYPE", "float32")  # float32 or float16
+CORPUS_INDEX_DIR = os.environ.get("CORPUS_INDEX_DIR", ".cache/corpus_index")
+KEYWORDS_CSV = os.environ.get("KEYWORDS_CSV", "keyword_extraction.csv")
+JOB_POLL_SECONDS = 0.5  # How often a page showing a running job refreshes
+PRIOR_BULLETIN_MIN_SCORE = 0.5  # Cosine similarity (all-MiniLM-L6-v2) a prior-bulletin passage needs to be added to a chat prompt
 
 # Initialize session state
 if 'conversations' not in st.session_state:
@@ -63,12 +54,12 @@ if 'is_admin' not in st.session_state:
     st.session_state.is_admin = False
 if 'admin_password_hash' not in st.session_state:
     st.session_state.admin_password_hash = None
-if 'context' not in st.session_state:
-    st.session_state.context = ""
-if 'context_embeddings' not in st.session_state:
-    st.session_state.context_embeddings = None
+if 'sentence_index' not in st.session_state:
+    st.session_state.sentence_index = None
 if 'attached_file_content' not in st.session_state:
     st.session_state.attached_file_content = None
+if 'document_index' not in st.session_state:
+    st.session_state.document_index = None
 if 'file_uploaded' not in st.session_state:
     st.session_state.file_uploaded = False
 if 'guided_answers' not in st.session_state:
@@ -83,23 +74,71 @@ if 'summary_generated' not in st.session_state:
     st.session_state.summary_generated = False
 if 'checkbox_selections' not in st.session_state:
     st.session_state.checkbox_selections = {}
+if 'chat_job' not in st.session_state:
+    st.session_state.chat_job = None
+if 'user_id' not in st.session_state:
+    st.session_state.user_id = uuid.uuid4().hex  # Fair-queuing key for this session's LLM requests
 
-# Initialize embeddings model
-@st.cache_resource
+# Load the embeddings model (torch) and the corpus index in the background, while the user is on the upload screen
 def load_embeddings_model():
-    return SentenceTransformer('all-MiniLM-L6-v2')
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(EMBEDDING_MODEL)
+    model.encode("warm-up", normalize_embeddings=True)  # First encode pays for lazy initialization
+    return model
+
+def update_keyword_embeddings(model_future):
+    # Embeds new or changed keyword rows, so the first prompt only has to memory-map the result
+    return open_keyword_embeddings(KEYWORDS_CSV, model_future.result(), EMBEDDING_MODEL)
+
+@st.cache_resource
+def start_background_loads():
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="warm-up")
+    embeddings_model = executor.submit(load_embeddings_model)
+    return {
+        "embeddings_model": embeddings_model,
+        "corpus_index": executor.submit(CorpusIndex.load, CORPUS_INDEX_DIR),
+        "keyword_embeddings": executor.submit(update_keyword_embeddings, embeddings_model),
+    }
+
+def get_background_resource(name):
+    future = start_background_loads()[name]
+    try:
+        return future.result()
+    except Exception:
+        start_background_loads.clear()  # Retry the load on the next call
+        raise
 
-embeddings_model = load_embeddings_model()
+def get_embeddings_model():
+    return get_background_resource("embeddings_model")
 
-# Initialize tokenizer
-tokenizer = tiktoken.get_encoding("cl100k_base")
+def get_corpus_index():
+    return get_background_resource("corpus_index")
+
+start_background_loads()
+
+# Initialize on-disk embedding cache, shared by every worker process
+@st.cache_resource
+def load_embedding_cache():
+    return EmbeddingCache(EMBEDDING_CACHE_DIR, EMBEDDING_MODEL, max_bytes=EMBEDDING_CACHE_MAX_MB * 1024 * 1024, dtype=EMBEDDING_CACHE_DTYPE)
 
-# Load keywords
-@st.cache_data
-def load_keywords():
-    return pd.read_csv('keyword_extraction.csv')
+embedding_cache = load_embedding_cache()
 
-keywords_df = load_keywords()
+# Load keywords from the memory-mapped store next to the CSV; keyed on the CSV's mtime so an
+# updated corpus (keyword_corpus.py) is picked up without a restart
+@st.cache_resource(max_entries=1)
+def load_keyword_index(path, mtime):
+    return open_keyword_index(path)
+
+def get_keyword_index():
+    return load_keyword_index(KEYWORDS_CSV, os.path.getmtime(KEYWORDS_CSV))
+
+@st.cache_resource(max_entries=1)
+def load_keyword_embeddings(path, mtime):
+    get_background_resource("keyword_embeddings")  # Wait for the startup update rather than embedding twice
+    return open_keyword_embeddings(path, get_embeddings_model(), EMBEDDING_MODEL)
+
+def get_keyword_embeddings():
+    return load_keyword_embeddings(KEYWORDS_CSV, os.path.getmtime(KEYWORDS_CSV))
 
 # Functions
 def load_questions():
@@ -140,48 +179,54 @@ def save_password(password):
         f.write(st.session_state.admin_password_hash)
 
 def read_file_content(file):
-    file_extension = os.path.splitext(file.name)[1].lower()
-    
     if file.size > MAX_FILE_SIZE:
         raise ValueError(f"File size ({file.size / (1024 * 1024):.2f} MB) exceeds the maximum allowed size ({MAX_FILE_SIZE / (1024 * 1024)} MB)")
 
-    if file_extension == '.txt':
-        return file.getvalue().decode('utf-8')
-    elif file_extension == '.docx':
-        return docx2txt.process(io.BytesIO(file.getvalue()))
-    elif file_extension == '.pdf':
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(file.getvalue()))
-        return ' '.join(page.extract_text() for page in pdf_reader.pages)
-    elif file_extension == '.csv':
-        csv_reader = csv.reader(io.StringIO(file.getvalue().decode('utf-8')))
-        return '\n'.join(','.join(row) for row in csv_reader)
-    else:
-        raise ValueError("Unsupported file format")
-
-def get_relevant_file_chunk(query, file_content, top_k=1):
-    # Break the file content into smaller chunks
-    file_chunks = smart_chunk_prompt(file_content, max_tokens=800)  # Adjust max_tokens as needed for chunk size
-    
-    # Encode the chunks and the query using the embedding model
-    embeddings = [embeddings_model.encode(chunk) for chunk in file_chunks]
-    query_embedding = embeddings_model.encode([query])
-    
-    # Calculate cosine similarities between the query and each chunk
-    similarities = cosine_similarity(query_embedding, embeddings).flatten()
-    top_indices = np.argsort(similarities)[-top_k:]  # Get indices of the most similar chunks
-    
-    # Combine the top relevant chunks into a single context
-    relevant_chunks = [file_chunks[i] for i in top_indices]
-    return "\n\n".join(relevant_chunks)
+    # Parse from a file on disk rather than another in-memory copy; PDF pages are extracted in parallel
+    path = spool_upload(file)
+    try:
+        return read_document(path, file.name)
+    finally:
+        os.remove(path)
+
+def build_document_index(file_content):
+    return DocumentIndex.build(file_content, tokenizer, get_embeddings_model(), max_tokens=800, cache=embedding_cache)  # Adjust max_tokens as needed for chunk size
+
+def build_sentence_index(file_content):
+    return SentenceIndex.build(file_content, get_embeddings_model(), cache=embedding_cache)
+
+def build_section_router():
+    # Routes summary chunks to bulletin sections using the sentence embeddings computed at upload time
+    if st.session_state.sentence_index is None:
+        return None
+    return SectionRouter.build(st.session_state.sentence_index, get_embeddings_model(), SECTION_INSTRUCTIONS)
+
+def encode_query(query):
+    return get_embeddings_model().encode(query, convert_to_numpy=True, normalize_embeddings=True)
+
+def get_relevant_file_chunk(query_embedding, document_index, top_k=1):
+    # Score the query against the chunk embeddings computed at upload time
+    top_indices = document_index.top_indices(query_embedding, top_k)
+    relevant_chunks = [document_index.chunk(i) for i in top_indices]
+    relevant_tokens = sum(document_index.chunk_tokens(i) for i in top_indices)
+    return "\n\n".join(relevant_chunks), relevant_tokens
+
+def get_similar_bulletins(query_embedding, top_k=3):
+    corpus_index = get_corpus_index()
+    if corpus_index is None:
+        return []
+    return corpus_index.similar_bulletins(query_embedding, top_k=top_k)
 
 def get_conversation_context(conversation, query, max_tokens=3000):
     context = []
     current_length = 0
+    query_embedding = encode_query(query)
 
     # Step 1: Retrieve and include the relevant chunk based on the current query
     if st.session_state.attached_file_content:
-        relevant_chunk = get_relevant_file_chunk(query, st.session_state.attached_file_content, top_k=1)
-        relevant_chunk_tokens = count_tokens(relevant_chunk)
+        if st.session_state.document_index is None:
+            st.session_state.document_index = build_document_index(st.session_state.attached_file_content)
+        relevant_chunk, relevant_chunk_tokens = get_relevant_file_chunk(query_embedding, st.session_state.document_index, top_k=1)
         
         # Ensure the relevant chunk fits within the max token limit
         if relevant_chunk_tokens <= max_tokens:
@@ -189,99 +234,31 @@ def get_conversation_context(conversation, query, max_tokens=3000):
             current_length += relevant_chunk_tokens
         else:
             # Truncate the relevant chunk to fit within the token limit
-            truncated_chunk = tokenizer.decode(tokenizer.encode(relevant_chunk)[:max_tokens])
+            truncated_chunk = tokenizer.decode(tokenizer.encode_ordinary(relevant_chunk)[:max_tokens])
             context.append({"role": "system", "content": f"Relevant Content from File:\n{truncated_chunk}"})
-            current_length += count_tokens(truncated_chunk)
             return context  # No room left for conversation history
 
-    # Step 2: Add as much of the conversation history as possible
-    for message in reversed(conversation):
-        message_tokens = count_tokens(message['content'])
-        if current_length + message_tokens > max_tokens:
-            # Truncate the message to fit within the remaining token limit
-            available_tokens = max_tokens - current_length
-            truncated_message = tokenizer.decode(tokenizer.encode(message['content'])[:available_tokens])
-            context.insert(0, {"role": message['role'], "content": truncated_message})
-            current_length += count_tokens(truncated_message)
-            break  # Stop adding more messages once the limit is reached
-        else:
-            context.insert(0, message)
-            current_length += message_tokens
-
-    return context
-
-# Fuzzy matching function for keywords
-def fuzzy_match_keywords(prompt):
-    # Assuming keywords_df is loaded with the keyword data
-    checked_keywords = keywords_df[keywords_df['Checked'].notna()]
-    best_match = process.extractOne(prompt, checked_keywords['Checked'])
-    
-    if best_match and best_match[1] > 75:  # Adjust threshold as needed
-        matched_row = checked_keywords[checked_keywords['Checked'] == best_match[0]].iloc[0]
-        keywords = matched_row['Keywords'].split(',')
-        filtered_keywords = [kw.strip() for kw in keywords if not is_region_specific(kw.strip())]
-        return ', '.join(filtered_keywords)
-    else:
-        return ""
+    # Step 2: Include the closest passage from a prior bulletin if it is related to the question and fits
+    similar = get_similar_bulletins(query_embedding, top_k=1)
+    if similar and similar[0]['score'] >= PRIOR_BULLETIN_MIN_SCORE:
+        prior_chunk = get_corpus_index().read_chunk(similar[0]['row'])
+        prior_chunk_tokens = count_tokens(prior_chunk)
+        if current_length + prior_chunk_tokens <= max_tokens:
+            context.append({"role": "system", "content": f"Related Prior Bulletin ({similar[0]['filename']}):\n{prior_chunk}"})
+            current_length += prior_chunk_tokens
 
-def is_region_specific(keyword):
-    region_specific_terms = ['USA', 'EU', 'China', 'Japan', 'Korea', 'Canada', 'Australia', 'UK', 'Germany', 'France', 'Italy', 'Spain']
-    return any(term.lower() in keyword.lower() for term in region_specific_terms)
+    # Step 3: Add as much of the conversation history as possible, using each message's cached token count
+    return pack_history(conversation, max_tokens - current_length, tokenizer) + context
 
-# Updated guided_prompt_creation function
 def guided_prompt_creation():
-    suggested_prompt = "Please summarize the attached document with the following considerations:\n\n"
-    formatted_prompt = "Summary of your inputs:\n\n"
-    
-    for section, data in st.session_state.guided_questions.items():
-        suggested_prompt += f"{section}:\n"
-        formatted_prompt += f"**{section}:**\n"
-        for question in data.get('questions', []):
-            question_text = question.get('question', '')
-            answer = st.session_state.guided_answers.get(question_text, '')
-            
-            suggested_prompt += f"- {question_text}: {answer}\n"
-            formatted_prompt += f"- {question_text}: {answer}\n"
-            
-            # Handle follow-up questions for yes/no questions
-            if question.get('type') == 'Yes/No' and answer.lower() in ['yes', 'no']:
-                for follow_up in question.get('follow_up', []):
-                    if follow_up['condition'].lower() == answer.lower():
-                        follow_up_answer = st.session_state.guided_answers.get(follow_up['question'], '')
-                        suggested_prompt += f"  - {follow_up['question']}: {follow_up_answer}\n"
-                        formatted_prompt += f"  - {follow_up['question']}: {follow_up_answer}\n"
-        
-        suggested_prompt += "\n"
-        formatted_prompt += "\n"
-
-    # Add fuzzy matched keywords
-    keywords = fuzzy_match_keywords(suggested_prompt)
-    if keywords:
-        suggested_prompt += f"\nRelevant Keywords: {keywords}\n\n"
-
-
-    prompt_instructions = """
-    Please provide a comprehensive summary for a bulletin based on these factors. Pretend that you are a regulatory engineer whose job is to interpret this document into an internal regulatory bulletin for engineers to follow some important compliance guidance. Do not focus on punishments or penalties. Please provide the summary with all the following sections, and all of them should be filled in with corresponding information:
-    1) Program Requirements Summary: a 2-3 sentence, brief summary of the regulation.
-    2) Regulation Publication Date: the date the regulation was published. If regulation has not been published, leave this blank.
-    3) Enforcement Date: This is the effective date of the regulation.
-    4) Enforcement based on: Type of enforcement
-    5) Compliance Checkpoint: How is regulation enforced upon entry?
-    6) Regulation Status: Type of Regulation Status
-    7) What is current process: If a regulation revision, this will be a 2-3 sentence summary of the current process, if it is a new regulation, note that it is new
-    8) What has changed from current process:  2-3 sentence summary of what is changing from existing regulation process.  This section is what is used for Bulletin email summaries. Character limit has been increased to 1000. Must ensure Summary in properties reflects same as Bulletin
-    9) Key Details – Legislation Requirement: This section is the regulation requirements. What is needed to reach compliance.
-    10) Requirement: Frequently used Requirements are listed in the table template, add additional requirements as required, and delete those not relevant.
-    11) Dependency: Is the requirement dependent on another requirement in the table? If so, list the requirement that must be completed to meet the requirement.
-    12) Details of Requirement: High level explanation of the regulatory requirement
-    13) Wireless Technology Scope: For Wireless Programs only, leave blank if not related
-    14) Detail Requirements: This is details of Regulation.  May include some tables and technical detail copied from regulation.  Should not, however be a straight copy/paste.
-    """
-
-    suggested_prompt += prompt_instructions
-    formatted_prompt += "**Instructions for the AI:**\n" + prompt_instructions
-
-    return suggested_prompt, formatted_prompt
+    similar_bulletins = []
+    suggested_keywords = None
+    if st.session_state.document_index is not None:
+        document_embedding = st.session_state.document_index.centroid()
+        similar_bulletins = [result['filename'] for result in get_similar_bulletins(document_embedding)]
+        suggested_keywords = get_keyword_embeddings().suggest(document_embedding)
+    keyword_index = get_keyword_index() if suggested_keywords is None else None
+    return build_guided_prompt(st.session_state.guided_questions, st.session_state.guided_answers, keyword_index, similar_bulletins, suggested_keywords)
 
 def process_follow_up_question(follow_up):
     question_text = follow_up.get('question', '')
@@ -302,264 +279,65 @@ def process_follow_up_question(follow_up):
     
     return None
 
-def count_tokens(text):
-    return len(tokenizer.encode(text))
-
-def smart_chunk_prompt(prompt, max_tokens=4000):
-    tokens = tokenizer.encode(prompt)
-    chunks = []
-    current_chunk = []
-    current_length = 0
-    
-    sentences = re.split('(?<=[.!?]) +', prompt)
-    for sentence in sentences:
-        sentence_tokens = tokenizer.encode(sentence)
-        if current_length + len(sentence_tokens) > max_tokens and current_chunk:
-            chunks.append(tokenizer.decode(current_chunk))
-            current_chunk = []
-            current_length = 0
-        current_chunk.extend(sentence_tokens)
-        current_length += len(sentence_tokens)
-    
-    if current_chunk:
-        chunks.append(tokenizer.decode(current_chunk))
-    
-    return chunks
-
-def add_instructions_to_chunk(chunk, original_prompt):
-    parts = original_prompt.split("User Input:", 1)
-    
-    if len(parts) > 1:
-        guided_prompt = parts[0].strip()
-        user_input_and_file = parts[1].strip()
-    else:
-        guided_prompt = original_prompt
-        user_input_and_file = ""
-
-    guided_prompt = guided_prompt.split("Attached File Content:", 1)[0].strip()
-
-    instructions = f"""
-    Instructions based on the guided prompt:
-    {guided_prompt}
-
-    Note: This is a part of a larger document. For any sections where information is not available in this chunk, please write 'Information not available in this chunk.'
-
-    User Input and/or File Content:
-    {user_input_and_file}
-
-    Chunk content:
-    {chunk}
-    """
-
-    return instructions.strip()
-
-def process_chunk(chunk, chunk_num, total_chunks, original_prompt):
-    url = "https://opensource-challenger-api.prdlvgpu1.aiaccel.dell.com/v1/chat/completions"
-    headers = {
-        'accept': 'application/json',
-        'api-key': os.environ["CHALLENGER_GENAI_API_KEY"],
-        'Content-Type': 'application/json'
-    }
-    
-    system_message = "You are a helpful AI assistant. Respond directly to the user without mentioning yourself in the third person or commenting on the nature of the response."
-    
-    if chunk_num > 1:
-        chunk_with_instructions = add_instructions_to_chunk(chunk, original_prompt)
-    else:
-        chunk_with_instructions = chunk
-    
-    messages = [
-        {"role": "system", "content": system_message},
-        {"role": "user", "content": chunk_with_instructions}
-    ]
-    
-    data = {
-        "model": MODEL,  
-        "messages": messages,
-        "temperature": 0.4,
-        "top_p": 0.95,
-        "max_tokens": MAX_OUTPUT_TOKENS,
-        "stream": True
-    }
-    
-    logger.debug(f"Processing chunk {chunk_num} of {total_chunks}")
-    logger.debug(f"Request URL: {url}")
-    logger.debug(f"Request Headers: {json.dumps(headers, indent=2)}")
-    logger.debug(f"Request Payload: {json.dumps(data, indent=2)}")
-    logger.debug(f"Total input tokens: {count_tokens(system_message) + count_tokens(chunk_with_instructions)}")
-    
-    try:
-        with requests.post(url, headers=headers, json=data, stream=True, verify=False) as response:
-            logger.debug(f"Response Status Code: {response.status_code}")
-            logger.debug(f"Response Headers: {json.dumps(dict(response.headers), indent=2)}")
-            
-            response.raise_for_status()
-            chunk_response = ""
-            for line in response.iter_lines():
-                if line:
-                    decoded_line = line.decode('utf-8')
-                    logger.debug(f"Received line: {decoded_line}")
-                    if decoded_line.startswith("data: "):
-                        if decoded_line.strip() == "data: [DONE]":
-                            break
-                        try:
-                            json_response = json.loads(decoded_line[6:])
-                            if 'choices' in json_response and len(json_response['choices']) > 0:
-                                delta = json_response['choices'][0].get('delta', {})
-                                if 'content' in delta:
-                                    chunk_response += delta['content']
-                        except json.JSONDecodeError:
-                            logger.error(f"Failed to decode JSON: {decoded_line}")
-                            continue
-            return chunk_response
-    except requests.RequestException as e:
-        logger.error(f"Request failed for chunk {chunk_num}: {str(e)}")
-        if hasattr(e, 'response') and e.response is not None:
-            logger.error(f"Response content: {e.response.text}")
-        return f"Error processing chunk {chunk_num}: {str(e)}"
-
-def process_chunks_parallel(chunks, original_prompt):
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [executor.submit(process_chunk, chunk, i+1, len(chunks), original_prompt) 
-                   for i, chunk in enumerate(chunks)]
-        responses = []
-        for future in concurrent.futures.as_completed(futures):
-            responses.append(future.result())
-    return responses
-
-def process_summary_chunk(chunk, original_prompt):
-    url = "https://opensource-challenger-api.prdlvgpu1.aiaccel.dell.com/v1/chat/completions"
-    headers = {
-        'accept': 'application/json',
-        'api-key': os.environ["CHALLENGER_GENAI_API_KEY"],
-        'Content-Type': 'application/json'
-    }
-
-    # Use the original prompt instruction as the base and append the chunk for data extraction
-    instruction_match = re.search(r"Please provide .+?:\n", original_prompt, re.DOTALL)
-    if instruction_match:
-        instructions = instruction_match.group(0)
-    else:
-        instructions = original_prompt
-
-    # Modify the prompt to request data extraction and filling in the blanks
-    summary_prompt = f"{instructions}\n\nPlease extract relevant information from the following chunk to populate the instructions provided above:\n\n{chunk}"
-
-    system_message = "You are a helpful AI assistant. Extract relevant information from the provided chunk and use it to populate the sections in the instructions. If information for a section is not available in the chunk, indicate it with 'Not applicable'."
-
-    messages = [
-        {"role": "system", "content": system_message},
-        {"role": "user", "content": summary_prompt}
-    ]
-
-    input_tokens = sum(count_tokens(message['content']) for message in messages)
-    max_context_length = 8192
-    available_tokens = max_context_length - input_tokens - 100
-
-    if available_tokens <= 0:
-        max_prompt_tokens = max_context_length - count_tokens(system_message) - 100
-        prompt_tokens = tokenizer.encode(summary_prompt)[:max_prompt_tokens]
-        summary_prompt = tokenizer.decode(prompt_tokens)
-        messages = [
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": summary_prompt}
-        ]
-        available_tokens = max_context_length - count_tokens(system_message) - count_tokens(summary_prompt) - 100
-
-    max_tokens = min(available_tokens, 4000)
-
-    data = {
-        "model": MODEL,  
-        "messages": messages,
-        "temperature": 0.4,
-        "top_p": 0.95,
-        "max_tokens": max_tokens,
-        "stream": True
-    }
-
-    try:
-        with requests.post(url, headers=headers, json=data, stream=True, verify=False) as response:
-            summary_response = ""
-            for line in response.iter_lines():
-                if line:
-                    decoded_line = line.decode('utf-8')
-                    if decoded_line.startswith("data: "):
-                        if decoded_line.strip() == "data: [DONE]":
-                            break
-                        try:
-                            json_response = json.loads(decoded_line[6:])
-                            if 'choices' in json_response and len(json_response['choices']) > 0:
-                                delta = json_response['choices'][0].get('delta', {})
-                                if 'content' in delta:
-                                    summary_response += delta['content']
-                        except json.JSONDecodeError:
-                            continue
-            return summary_response
-    except requests.RequestException as e:
-        logger.error(f"Request failed during summarization: {str(e)}")
-        return f"Error summarizing chunk: {str(e)}"
-
-def summarize_responses(combined_response, original_prompt):
-    chunks = smart_chunk_prompt(combined_response, max_tokens=4000)
-    
-    if len(chunks) == 1:
-        return process_summary_chunk(chunks[0], original_prompt)
-    
-    summaries = process_chunks_parallel(chunks, original_prompt)
-    
-    combined_summary = combine_meaningful_parts(summaries)
-    
-    # After combining, ensure the final output includes the full instructions
-    final_summary = f"{original_prompt}\n\n{combined_summary}"
-    
-    if count_tokens(final_summary) > 4000:
-        return summarize_responses(final_summary, original_prompt)
-    
-    return final_summary
-
-def combine_meaningful_parts(summaries):
-    combined_parts = {}
-    for summary in summaries:
-        parts = summary.split('\n\n')
-        for part in parts:
-            if ':' in part:
-                key, content = part.split(':', 1)
-                key = key.strip()
-                content = content.strip()
-                if content.lower() not in ['not applicable', 'information not available in this chunk', 'n/a']:
-                    if key in combined_parts:
-                        combined_parts[key] += '\n' + content
-                    else:
-                        combined_parts[key] = content
-    
-    return '\n\n'.join([f"{key}: {value}" for key, value in combined_parts.items()])
-
-def get_model_response(model, prompt):
-    system_message = "You are a helpful AI assistant. Respond directly to the user without mentioning yourself in the third person or commenting on the nature of the response."
-    
-    max_chunk_tokens = MAX_TOKENS - count_tokens(system_message) - MAX_OUTPUT_TOKENS - BUFFER_TOKENS
-    chunks = smart_chunk_prompt(prompt, max_chunk_tokens)
-    
-    if len(chunks) > 1:
-        logger.info(f"Input split into {len(chunks)} chunks for processing.")
-        responses = process_chunks_parallel(chunks, prompt)
-        final_response = summarize_responses("\n\n".join(responses), prompt)
-    else:
-        final_response = process_chunk(chunks[0], 1, 1, prompt)
-    
-    return final_response
-
 def get_relevant_context(query, top_k=3):
-    if st.session_state.context_embeddings is None:
+    if st.session_state.sentence_index is None:
         return ""
     
-    query_embedding = embeddings_model.encode([query])
-    similarities = cosine_similarity(query_embedding, st.session_state.context_embeddings)[0]
-    top_indices = np.argsort(similarities)[-top_k:]
-    
-    relevant_sentences = [st.session_state.context.split('.')[i] for i in top_indices]
-    context = ' '.join(relevant_sentences)
-    return context
+    return st.session_state.sentence_index.relevant_context(encode_query(query), top_k=top_k)
+
+def generate_response(stage, user, prompt, router=None, sink=None, on_progress=None):
+    # Chat answers are interactive: the LLM scheduler sends them ahead of any summary's chunk calls
+    priority = INTERACTIVE if stage == "chat" else BULK
+    with request_context(user, priority), metrics.stage(stage):
+        return get_model_response(MODEL, prompt, sink=sink, on_progress=on_progress, router=router)
+
+def show_job(job):
+    # Render the job's text so far and its progress; returns True once it has finished
+    if job.is_finished:
+        return True
+    if job.text:
+        st.markdown(job.text + "▌")
+    elif job.status == "queued":
+        st.markdown(f"Waiting to start ({get_job_queue().position(job.id) + 1} in queue)...")
+    else:
+        st.markdown("Generating response... Please wait.")
+    if job.progress is not None:
+        done, total, tokens, elapsed = job.progress
+        rate = tokens / elapsed if elapsed > 0 else 0.0
+        st.caption(f"Processed {done}/{total} chunks · {tokens} tokens generated · {rate:.0f} tokens/s")
+    return False
+
+def start_new_analysis():
+    # Stop the old document's requests instead of letting them stream answers nobody will read
+    for job_id in (st.session_state.summary_job, st.session_state.chat_job):
+        if job_id is not None:
+            get_job_queue().cancel(job_id, "replaced by a new analysis")
+    st.session_state.file_uploaded = False
+    st.session_state.guided_answers = {}
+    st.session_state.prompt_ready = False
+    st.session_state.attached_file_content = None
+    st.session_state.document_index = None
+    st.session_state.sentence_index = None
+    st.session_state.chat_counter = 0  # Reset the chat counter
+    st.session_state.summary_generated = False  # Reset the summary generation flag
+    st.session_state.summary_job = None
+    st.session_state.chat_job = None
+    st.query_params.pop("job", None)
+
+def restore_summary_job():
+    # A reconnecting browser finds its summary job through the ?job= URL parameter
+    job = get_job_queue().get(st.query_params.get("job"))
+    if job is None or job.kind != "summary":
+        return
+    st.session_state.summary_job = job.id
+    st.session_state.attached_file_content = job.metadata["document"]
+    st.session_state.guided_answers = job.metadata["guided_answers"]
+    st.session_state.file_uploaded = True
+    st.session_state.prompt_ready = True
+
+if 'summary_job' not in st.session_state:
+    st.session_state.summary_job = None
+    restore_summary_job()
 
 
 # Streamlit UI
@@ -611,7 +389,11 @@ if page == "Chat":
         uploaded_file = st.file_uploader("Upload a file", type=["txt", "docx", "pdf", "csv"])
         if uploaded_file is not None:
             try:
-                st.session_state.attached_file_content = read_file_content(uploaded_file)
+                with metrics.stage("read_file", bytes=uploaded_file.size):
+                    st.session_state.attached_file_content = read_file_content(uploaded_file)
+                with metrics.stage("embedding"):
+                    st.session_state.document_index = build_document_index(st.session_state.attached_file_content)
+                    st.session_state.sentence_index = build_sentence_index(st.session_state.attached_file_content)
                 st.session_state.file_uploaded = True
                 st.success("File uploaded successfully!")
                 st.rerun()
@@ -674,36 +456,48 @@ if page == "Chat":
 
     # Show constructed prompt and chat interface
     else:
+        # Reset button, rendered before anything that polls a running job so it can stop that job
+        st.button("Start New Analysis", key="start_new_analysis", on_click=start_new_analysis)
+
         if not st.session_state.summary_generated:
-            suggested_prompt, formatted_prompt = guided_prompt_creation()
-            
+            if st.session_state.summary_job is None:
+                suggested_prompt, formatted_prompt = guided_prompt_creation()
+                context = get_relevant_context(suggested_prompt)
+                full_prompt = build_summary_prompt(suggested_prompt, st.session_state.attached_file_content, context)
+                st.session_state.summary_job = get_job_queue().submit(
+                    "summary", generate_response, "summary", st.session_state.user_id, full_prompt, build_section_router(), formatted_prompt=formatted_prompt,
+                    document=st.session_state.attached_file_content, guided_answers=dict(st.session_state.guided_answers))
+                st.query_params["job"] = st.session_state.summary_job
+
+            job = get_job_queue().get(st.session_state.summary_job)
+            if job is None or job.status == CANCELLED:
+                # Expired, cancelled while nobody was viewing it, or the server restarted since it was submitted: generate it again
+                st.session_state.summary_job = None
+                st.rerun()
+
             st.subheader("Constructed Prompt Based on Your Answers")
-            st.markdown(formatted_prompt)
-            
+            st.markdown(job.metadata["formatted_prompt"])
+
             st.subheader("Generated Summary")
             with st.chat_message("assistant"):
-                message_placeholder = st.empty()
-
-                full_prompt = f"{suggested_prompt}\n\nPlease provide a summary based on the above considerations and the following attached file content:\n\n{st.session_state.attached_file_content}"
-
-                context = get_relevant_context(full_prompt)
-                full_prompt = f"Context: {context}\n\n{full_prompt}"
-
-                try:
-                    full_response = get_model_response(MODEL, full_prompt)
-                    message_placeholder.markdown(full_response)
-                except Exception as e:
-                    error_message = f"An error occurred while generating the summary: {str(e)}"
+                if not show_job(job):
+                    time.sleep(JOB_POLL_SECONDS)
+                    st.rerun()
+                if job.status != DONE:
+                    error_message = f"An error occurred while generating the summary: {job.error}"
                     st.error(error_message)
-                    logger.error(error_message)
                     full_response = "I apologize, but an error occurred while generating the summary. Please try again or contact support if the problem persists."
-                    message_placeholder.markdown(full_response)
-            
+                else:
+                    full_response = job.result
+                with metrics.stage("render"):
+                    st.markdown(full_response)
+            st.session_state.summary_job = None
+
             if st.session_state.current_conversation is None:
                 st.session_state.current_conversation = f"Chat {len(st.session_state.conversations) + 1}"
                 st.session_state.conversations[st.session_state.current_conversation] = []
             
-            st.session_state.conversations[st.session_state.current_conversation].append({"role": "assistant", "content": full_response})
+            st.session_state.conversations[st.session_state.current_conversation].append(make_message("assistant", full_response, tokenizer))
             st.session_state.summary_generated = True
             st.rerun()
 
@@ -719,40 +513,40 @@ if page == "Chat":
         if prompt:
             st.session_state.chat_counter += 1
             
-            st.session_state.conversations[st.session_state.current_conversation].append({"role": "user", "content": prompt})
+            st.session_state.conversations[st.session_state.current_conversation].append(make_message("user", prompt, tokenizer))
             with st.chat_message("user"):
                 st.markdown(prompt)
 
-            with st.chat_message("assistant"):
-                message_placeholder = st.empty()
-                message_placeholder.markdown("Generating response... Please wait.")
-                query = prompt  # or any other variable that contains the current query
-                conversation_context = get_conversation_context(st.session_state.conversations[st.session_state.current_conversation], query)
-                
-                context_prompt = "Based on the previous conversation and summary, please answer the following question:\n\n"
-                for message in conversation_context:
-                    context_prompt += f"{message['role'].capitalize()}: {message['content']}\n\n"
-                context_prompt += f"User: {prompt}\n\nAssistant:"
-
-                try:
-                    full_response = get_model_response(MODEL, context_prompt)
-                    message_placeholder.markdown(full_response)
-                    st.session_state.conversations[st.session_state.current_conversation].append({"role": "assistant", "content": full_response})
-                except Exception as e:
-                    st.error(f"An error occurred while generating the response: {str(e)}")
-                    logger.error(f"Error in model response: {str(e)}")
-            
+            query = prompt  # or any other variable that contains the current query
+            conversation_context = get_conversation_context(st.session_state.conversations[st.session_state.current_conversation], query)
+
+            context_prompt = "Based on the previous conversation and summary, please answer the following question:\n\n"
+            for message in conversation_context:
+                context_prompt += f"{message['role'].capitalize()}: {message['content']}\n\n"
+            context_prompt += f"User: {prompt}\n\nAssistant:"
+            st.session_state.chat_job = get_job_queue().submit("chat", generate_response, "chat", st.session_state.user_id, context_prompt)
             st.rerun()
+
+        # Answer to the latest question, while it is generated in the background
+        if st.session_state.chat_job is not None:
+            job = get_job_queue().get(st.session_state.chat_job)
+            if job is not None:
+                with st.chat_message("assistant"):
+                    if not show_job(job):
+                        time.sleep(JOB_POLL_SECONDS)
+                        st.rerun()
+                    if job.status == FAILED:
+                        st.error(f"An error occurred while generating the response: {job.error}")
+                    elif job.status == CANCELLED:
+                        st.warning("The answer was stopped before it finished. Please ask again.")
+                    else:
+                        with metrics.stage("render"):
+                            st.markdown(job.result)
+                        st.session_state.conversations[st.session_state.current_conversation].append(make_message("assistant", job.result, tokenizer))
+            st.session_state.chat_job = None
+            if job is not None and job.status == DONE:
+                st.rerun()
             
-        # Reset button
-        if st.button("Start New Analysis"):
-            st.session_state.file_uploaded = False
-            st.session_state.guided_answers = {}
-            st.session_state.prompt_ready = False
-            st.session_state.attached_file_content = None
-            st.session_state.chat_counter = 0  # Reset the chat counter
-            st.session_state.summary_generated = False  # Reset the summary generation flag
-            st.rerun()
 
 
 elif page == "Admin":
@@ -779,6 +573,33 @@ elif page == "Admin":
                 save_password(new_password)
                 st.success("Password changed successfully!")
 
+        st.header("Response Cache")
+        response_cache = get_response_cache()
+        cache_stats = response_cache.stats()
+        st.write(f"Entries: {cache_stats['entries']} ({cache_stats['bytes'] / (1024 * 1024):.1f} MB)")
+        st.write(f"Hits: {cache_stats['hits']} · Misses: {cache_stats['misses']} · Hit rate: {cache_stats['hit_rate']:.0%}")
+        response_cache.enabled = not st.checkbox("Bypass response cache", value=not response_cache.enabled, key="bypass_response_cache")
+        if st.button("Clear Response Cache"):
+            response_cache.clear()
+            st.success("Response cache cleared!")
+
+        st.header("Pipeline Metrics")
+        import pandas as pd
+        counters, series = metrics.snapshot()
+        if series:
+            st.dataframe(pd.DataFrame(
+                [{"metric": name, **labels, "count": count, "total": total, "p50": p50, "p95": p95}
+                 for name, labels, count, total, p50, p95 in series]
+            ))
+        if counters:
+            st.dataframe(pd.DataFrame([{"metric": name, **labels, "value": value} for name, labels, value in counters]))
+        if not counters and not series:
+            st.write("No metrics recorded yet in this server process.")
+        st.download_button("Download Prometheus Metrics", metrics.to_prometheus(), file_name="metrics.prom", mime="text/plain")
+        if st.button("Reset Metrics"):
+            metrics.reset()
+            st.rerun()
+
         st.header("Question Management")
         
         # Add new section
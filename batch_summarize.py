@@ -0,0 +1,286 @@
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import orjson
+
+import summary_pipeline as pipeline
+from document_reader import SUPPORTED_EXTENSIONS, read_document
+from cancellation import CancelToken, cancel_scope
+from llm_scheduler import BULK, request_context
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_documents(input_dir):
+    paths = []
+    for directory, _, filenames in os.walk(input_dir):
+        paths.extend(os.path.join(directory, name) for name in filenames if name.lower().endswith(SUPPORTED_EXTENSIONS))
+    return sorted(paths)
+
+
+def extract_file(path):
+    # Runs in a worker process, one file per process, so it does not start its own PDF page pool
+    return read_document(path, workers=1)
+
+
+def load_guided_answers(path):
+    with open(path, 'r') as f:
+        answers = json.load(f)
+    # Check-box answers may be given as lists; the app joins selections with ", "
+    return {question: ', '.join(answer) if isinstance(answer, list) else str(answer) for question, answer in answers.items()}
+
+
+def load_completed(output_path):
+    """Return {(file, sha256)} for every document already summarized in a results file."""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, 'rb') as f:
+        for line in f:
+            try:
+                record = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                continue  # A line cut short by an interrupted run
+            if record.get('status') == 'ok':
+                completed.add((record['file'], record['sha256']))
+    return completed
+
+
+class ResultWriter:
+    # Appends one JSON line per document and syncs it, so an interrupted run loses nothing it finished
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'ab')
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        with self._lock:
+            self._file.write(orjson.dumps(record) + b"\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class Retrieval:
+    """Embedding-based context for batch summaries, matching what the app adds to each prompt."""
+
+    def __init__(self, embeddings_model, embedding_cache=None, corpus_index=None, keyword_embeddings=None):
+        self.embeddings_model = embeddings_model
+        self.embedding_cache = embedding_cache
+        self.corpus_index = corpus_index
+        self.keyword_embeddings = keyword_embeddings
+        self._lock = threading.Lock()
+
+    def document_embedding(self, text):
+        from document_index import DocumentIndex
+        with self._lock:
+            document_index = DocumentIndex.build(text, pipeline.tokenizer, self.embeddings_model, max_tokens=800, cache=self.embedding_cache)
+        return document_index.centroid()
+
+    def similar_bulletins(self, document_embedding, top_k=3):
+        if self.corpus_index is None:
+            return []
+        return [result['filename'] for result in self.corpus_index.similar_bulletins(document_embedding, top_k=top_k)]
+
+    def suggested_keywords(self, document_embedding):
+        # None falls back to fuzzy matching the prompt against keyword_index
+        if self.keyword_embeddings is None:
+            return None
+        return self.keyword_embeddings.suggest(document_embedding)
+
+    def sentence_index(self, text):
+        from document_index import SentenceIndex
+        with self._lock:
+            return SentenceIndex.build(text, self.embeddings_model, cache=self.embedding_cache)
+
+    def relevant_context(self, sentence_index, query, top_k=3):
+        with self._lock:
+            query_embedding = self.embeddings_model.encode(query, convert_to_numpy=True, normalize_embeddings=True)
+        return sentence_index.relevant_context(query_embedding, top_k=top_k)
+
+    def section_router(self, sentence_index):
+        from section_routing import SectionRouter
+        with self._lock:
+            return SectionRouter.build(sentence_index, self.embeddings_model, pipeline.SECTION_INSTRUCTIONS)
+
+
+def summarize_document(text, guided_questions, guided_answers, keyword_index=None, retrieval=None):
+    similar_bulletins = []
+    suggested_keywords = None
+    if retrieval is not None:
+        document_embedding = retrieval.document_embedding(text)
+        similar_bulletins = retrieval.similar_bulletins(document_embedding)
+        suggested_keywords = retrieval.suggested_keywords(document_embedding)
+    suggested_prompt, _ = pipeline.build_guided_prompt(guided_questions, guided_answers, keyword_index, similar_bulletins, suggested_keywords)
+    context = ""
+    router = None
+    if retrieval is not None:
+        sentence_index = retrieval.sentence_index(text)
+        context = retrieval.relevant_context(sentence_index, suggested_prompt)
+        router = retrieval.section_router(sentence_index)
+    return pipeline.get_model_response(pipeline.MODEL, pipeline.build_summary_prompt(suggested_prompt, text, context), router=router)
+
+
+def run_batch(input_dir, output_path, guided_questions, guided_answers, keyword_index=None, retrieval=None,
+              extract_workers=None, documents=4):
+    """Summarize every supported file under input_dir into a JSON lines results file.
+
+    Files are parsed in a process pool while up to `documents` summaries run
+    at once; their LLM calls share the process-wide LLM scheduler, which
+    takes turns between documents so each keeps making progress.
+    Files already summarized with the same content hash are skipped, so an
+    interrupted run resumes where it stopped.
+    """
+    completed = load_completed(output_path)
+    pending = []
+    for path in find_documents(input_dir):
+        name = os.path.relpath(path, input_dir)
+        sha256 = file_sha256(path)
+        if (name, sha256) not in completed:
+            pending.append((path, name, sha256))
+    logger.info(f"{len(pending)} documents to summarize, {len(completed)} already done")
+
+    writer = ResultWriter(output_path)
+    run_token = CancelToken()  # Cancelled on the way out, e.g. on Ctrl-C, so in-flight requests stop too
+    counts = {"ok": 0, "error": 0}
+    counts_lock = threading.Lock()
+
+    def record(name, sha256, started, summary=None, error=None, characters=None):
+        with counts_lock:
+            counts["error" if error is not None else "ok"] += 1
+            message = f"[{counts['ok'] + counts['error']}/{len(pending)}] {name}: {'failed: ' + error if error else 'done'}"
+        writer.write({
+            "file": name,
+            "sha256": sha256,
+            "status": "error" if error is not None else "ok",
+            "summary": summary,
+            "error": error,
+            "characters": characters,
+            "seconds": round(time.perf_counter() - started, 3),
+            "finished_at": datetime.datetime.now().isoformat(timespec='seconds'),
+        })
+        logger.info(message)
+
+    def summarize(name, sha256, text, started):
+        try:
+            with cancel_scope(token=run_token), request_context(name, BULK):
+                summary = summarize_document(text, guided_questions, guided_answers, keyword_index, retrieval)
+            record(name, sha256, started, summary=summary, characters=len(text))
+        except Exception as e:
+            record(name, sha256, started, error=str(e), characters=len(text))
+
+    extract_pool = ProcessPoolExecutor(max_workers=extract_workers)
+    summary_pool = ThreadPoolExecutor(max_workers=documents)
+    try:
+        extractions = {extract_pool.submit(extract_file, path): (name, sha256, time.perf_counter()) for path, name, sha256 in pending}
+        summaries = []
+        for future in as_completed(extractions):
+            name, sha256, started = extractions[future]
+            try:
+                text = future.result()
+            except Exception as e:
+                record(name, sha256, started, error=f"Could not read file: {str(e)}")
+                continue
+            summaries.append(summary_pool.submit(summarize, name, sha256, text, started))
+        for future in summaries:
+            future.result()
+    finally:
+        run_token.cancel("interrupted")
+        extract_pool.shutdown(cancel_futures=True)
+        summary_pool.shutdown(cancel_futures=True)
+        writer.close()
+    return counts
+
+
+def export_parquet(jsonl_path, parquet_path):
+    import pandas as pd
+
+    results = pd.read_json(jsonl_path, lines=True, dtype={"file": str, "sha256": str})
+    # Keep the latest attempt per file, e.g. a success after an earlier failure
+    results = results.drop_duplicates(subset=["file"], keep="last")
+    results.to_parquet(parquet_path, index=False)
+    return len(results)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Summarize every document in a directory into bulletins.")
+    parser.add_argument("input_dir", help="Directory of .txt, .docx, .pdf and .csv files (searched recursively)")
+    parser.add_argument("answers", help="JSON file mapping guided question text to the answer")
+    parser.add_argument("--output", default="bulletins.jsonl", help="JSON lines results file; existing results are resumed")
+    parser.add_argument("--parquet", help="Also write the results to this Parquet file when the run finishes")
+    parser.add_argument("--questions", default="guided_questions.json")
+    parser.add_argument("--keywords", default="keyword_extraction.csv", help="Keyword CSV; keywords come from the most similar rows, or fuzzy matching with --no-context ('' to skip)")
+    parser.add_argument("--no-context", action="store_true", help="Skip embedding-based context and similar bulletins")
+    parser.add_argument("--documents", type=int, default=4, help="Documents summarized at the same time")
+    parser.add_argument("--max-in-flight", type=int, default=8, help="LLM requests in flight across all documents")
+    parser.add_argument("--extract-workers", type=int, help="Processes for file parsing (default: CPU count)")
+    args = parser.parse_args()
+
+    load_dotenv('.env', override=True)
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+    os.environ["LLM_MAX_IN_FLIGHT"] = str(args.max_in_flight)
+    # Nothing here is interactive, so no slots are held back for chat unless configured (e.g. sharing LLM_SCHEDULER_DIR with the app)
+    os.environ.setdefault("LLM_INTERACTIVE_RESERVED", "0")
+
+    with open(args.questions, 'r') as f:
+        guided_questions = json.load(f)
+    guided_answers = load_guided_answers(args.answers)
+
+    keyword_index = None
+    if args.keywords:
+        from keyword_index import open_keyword_index
+        keyword_index = open_keyword_index(args.keywords)
+
+    retrieval = None
+    if not args.no_context:
+        from sentence_transformers import SentenceTransformer
+
+        from corpus_index import CorpusIndex
+        from embedding_cache import EmbeddingCache
+
+        embedding_model = "all-MiniLM-L6-v2"
+        embeddings_model = SentenceTransformer(embedding_model)
+        keyword_embeddings = None
+        if args.keywords:
+            from keyword_index import open_keyword_embeddings
+            keyword_embeddings = open_keyword_embeddings(args.keywords, embeddings_model, embedding_model)
+        retrieval = Retrieval(
+            embeddings_model,
+            EmbeddingCache(
+                os.environ.get("EMBEDDING_CACHE_DIR", ".cache/embeddings"),
+                embedding_model,
+                max_bytes=int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "512")) * 1024 * 1024,
+                dtype=os.environ.get("EMBEDDING_CACHE_DTYPE", "float32"),
+            ),
+            CorpusIndex.load(os.environ.get("CORPUS_INDEX_DIR", ".cache/corpus_index")),
+            keyword_embeddings,
+        )
+
+    start = time.perf_counter()
+    counts = run_batch(args.input_dir, args.output, guided_questions, guided_answers, keyword_index, retrieval,
+                       extract_workers=args.extract_workers, documents=args.documents)
+    logger.info(f"Summarized {counts['ok']} documents ({counts['error']} failed) in {time.perf_counter() - start:.0f}s")
+    if args.parquet:
+        rows = export_parquet(args.output, args.parquet)
+        logger.info(f"Wrote {rows} results to {args.parquet}")
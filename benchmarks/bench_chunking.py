@@ -0,0 +1,77 @@
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+import tiktoken
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_chunking import chunk_spans
+
+WORDS = ("regulation compliance certification wireless frequency enforcement date product label "
+         "requirement testing importation authority declaration conformity energy safety emc "
+         "manufacturer shall must market surveillance annex directive module").split()
+
+
+def legacy_smart_chunk_prompt(prompt, tokenizer, max_tokens=4000):
+    # The sentence-by-sentence chunker this benchmark measures against
+    chunks = []
+    current_chunk = []
+    current_length = 0
+
+    sentences = re.split('(?<=[.!?]) +', prompt)
+    for sentence in sentences:
+        sentence_tokens = tokenizer.encode(sentence)
+        if current_length + len(sentence_tokens) > max_tokens and current_chunk:
+            chunks.append(tokenizer.decode(current_chunk))
+            current_chunk = []
+            current_length = 0
+        current_chunk.extend(sentence_tokens)
+        current_length += len(sentence_tokens)
+
+    if current_chunk:
+        chunks.append(tokenizer.decode(current_chunk))
+
+    return chunks
+
+
+def make_document(size_bytes, seed=0):
+    rng = random.Random(seed)
+    sentences = []
+    length = 0
+    while length < size_bytes:
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 40))).capitalize() + rng.choice('.!?')
+        sentences.append(sentence)
+        length += len(sentence) + 1
+    return ' '.join(sentences)
+
+
+def best_of(repeat, fn, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare chunker throughput on multi-MB documents.")
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--max-tokens", type=int, default=4000)
+    parser.add_argument("--overlap", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    tokenizer = tiktoken.get_encoding("cl100k_base")
+    print(f"{'size':>8} {'legacy MB/s':>12} {'new MB/s':>10} {'speedup':>8} {'chunks':>14}")
+    for size_mb in args.sizes_mb:
+        document = make_document(int(size_mb * 1024 * 1024))
+        megabytes = len(document.encode('utf-8')) / (1024 * 1024)
+        legacy_time, legacy_chunks = best_of(args.repeat, legacy_smart_chunk_prompt, document, tokenizer, args.max_tokens)
+        new_time, new_chunks = best_of(args.repeat, chunk_spans, document, tokenizer, args.max_tokens, args.overlap)
+        print(f"{megabytes:>6.1f}MB {megabytes / legacy_time:>12.2f} {megabytes / new_time:>10.2f} "
+              f"{legacy_time / new_time:>7.1f}x {len(legacy_chunks):>6}/{len(new_chunks):<6}")
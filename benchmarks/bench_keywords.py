@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from keyword_index import MATCH_THRESHOLD, KeywordIndex
+from rapidfuzz import fuzz, process, utils
+
+
+def legacy_fuzzy_match_keywords(prompt, keywords_df):
+    # The DataFrame scan this benchmark measures against
+    from fuzzywuzzy import process
+
+    checked_keywords = keywords_df[keywords_df['Checked'].notna()]
+    best_match = process.extractOne(prompt, checked_keywords['Checked'])
+
+    if best_match and best_match[1] > 75:
+        matched_row = checked_keywords[checked_keywords['Checked'] == best_match[0]].iloc[0]
+        keywords = matched_row['Keywords'].split(',')
+        filtered_keywords = [kw.strip() for kw in keywords if not legacy_is_region_specific(kw.strip())]
+        return ', '.join(filtered_keywords)
+    else:
+        return ""
+
+
+def legacy_is_region_specific(keyword):
+    region_specific_terms = ['USA', 'EU', 'China', 'Japan', 'Korea', 'Canada', 'Australia', 'UK', 'Germany', 'France', 'Italy', 'Spain']
+    return any(term.lower() in keyword.lower() for term in region_specific_terms)
+
+
+def grow_corpus(keywords_df, rows, seed=0):
+    # Resample the real rows with shuffled labels so larger corpora keep a realistic vocabulary
+    rng = random.Random(seed)
+    checked = keywords_df[keywords_df['Checked'].notna()]
+    records = list(checked.itertuples(index=False))
+    grown = []
+    for i in range(rows):
+        record = records[i % len(records)]
+        labels = [label.strip() for label in record.Checked.split(',')]
+        if i >= len(records):
+            rng.shuffle(labels)
+            labels = labels[:rng.randint(max(1, len(labels) // 2), len(labels))]
+        grown.append({"Filename": f"{i}_{record.Filename}", "Checked": ', '.join(labels), "Keywords": record.Keywords})
+    return pd.DataFrame(grown)
+
+
+def make_prompts(count, seed=0):
+    with open(os.path.join(ROOT, "guided_questions.json")) as f:
+        guided_questions = json.load(f)
+    rng = random.Random(seed)
+    prompts = []
+    for _ in range(count):
+        prompt = "Please summarize the attached document with the following considerations:\n\n"
+        for section, data in guided_questions.items():
+            prompt += f"{section}:\n"
+            for question in data.get('questions', []):
+                options = question.get('options') or ['Yes', 'No', 'TBD']
+                answer = ', '.join(rng.sample(options, rng.randint(1, min(3, len(options)))))
+                prompt += f"- {question.get('question', '')}: {answer}\n"
+            prompt += "\n"
+        prompts.append(prompt)
+    return prompts
+
+
+def full_scan_match(index, prompt):
+    # The index's lookup without candidate pruning: every row gets a WRatio score
+    best = process.extractOne(utils.default_process(prompt), index.choices.to_pylist(), scorer=fuzz.WRatio, processor=None)
+    if best is None or round(best[1]) <= MATCH_THRESHOLD:
+        return ""
+    return index.keywords(best[2])
+
+
+def per_query(fn, prompts):
+    start = time.perf_counter()
+    results = [fn(prompt) for prompt in prompts]
+    return (time.perf_counter() - start) / len(prompts), results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time keyword matching against the legacy DataFrame scan and check it against a full rapidfuzz scan.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--legacy-max-rows", type=int, default=10000, help="Skip the legacy scan above this size")
+    args = parser.parse_args()
+
+    keywords_df = pd.read_csv(os.path.join(ROOT, "keyword_extraction.csv"))
+    prompts = make_prompts(args.queries)
+    print(f"{'rows':>8} {'build s':>8} {'load ms':>8} {'legacy ms':>10} {'index ms':>9} {'speedup':>8} {'agree':>6}")
+    for rows in args.rows:
+        corpus = grow_corpus(keywords_df, rows)
+        start = time.perf_counter()
+        index = KeywordIndex.from_dataframe(corpus)
+        build = time.perf_counter() - start
+        # Time memory-mapping the saved store, which is what the app does once the store exists
+        with tempfile.TemporaryDirectory() as directory:
+            index.save(os.path.join(directory, "keywords.arrow"))
+            start = time.perf_counter()
+            index = KeywordIndex.load(os.path.join(directory, "keywords.arrow"))
+            load = time.perf_counter() - start
+        index_time, index_results = per_query(index.match, prompts)
+        # Share of queries where pruning returns the same keywords as scoring every row
+        agree = sum(full_scan_match(index, prompt) == result for prompt, result in zip(prompts, index_results)) / len(prompts)
+
+        if rows <= args.legacy_max_rows:
+            legacy_time, _ = per_query(lambda prompt: legacy_fuzzy_match_keywords(prompt, corpus), prompts)
+            print(f"{rows:>8} {build:>8.2f} {load * 1000:>8.1f} {legacy_time * 1000:>10.1f} {index_time * 1000:>9.2f} "
+                  f"{legacy_time / index_time:>7.0f}x {agree:>6.0%}")
+        else:
+            print(f"{rows:>8} {build:>8.2f} {load * 1000:>8.1f} {'-':>10} {index_time * 1000:>9.2f} {'-':>8} {agree:>6.0%}")
@@ -0,0 +1,189 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_chunking import make_document
+from mock_llm_server import MockLLMServer
+
+TRACKED = ("p50_seconds", "p95_seconds", "input_tokens")  # Compared against a baseline run
+
+
+def load_corpus(args):
+    if args.corpus_dir:
+        paths = sorted(glob.glob(os.path.join(args.corpus_dir, args.pattern)))
+        corpus = []
+        for path in paths:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                corpus.append((os.path.basename(path), f.read()))
+        return corpus
+    # Fixed seeds keep the synthetic corpus identical between releases
+    return [(f"synthetic-{size_kb}kb", make_document(size_kb * 1024, seed=size_kb)) for size_kb in args.sizes_kb]
+
+
+def build_prompt(pipeline, document, kind, guided_questions):
+    # Same shape as the prompts app_st.py sends for a bulletin summary (with unanswered questions) or a chat question
+    if kind == "bulletin":
+        suggested_prompt, _ = pipeline.build_guided_prompt(guided_questions, {})
+        return pipeline.build_summary_prompt(suggested_prompt, document)
+    return f"Based on the previous conversation and summary, please answer the following question:\n\nSystem: {document}\n\nUser: What are the key requirements?\n\nAssistant:"
+
+
+def build_router(pipeline, document, embeddings_model):
+    # Same section routing the app does, from the document's sentence embeddings
+    from document_index import SentenceIndex
+    from section_routing import SectionRouter
+    return SectionRouter.build(SentenceIndex.build(document, embeddings_model), embeddings_model, pipeline.SECTION_INSTRUCTIONS)
+
+
+def counter_total(counters, name):
+    return sum(value for counter, _, value in counters if counter == name)
+
+
+def run_document(pipeline, metrics, name, prompt, repeat, router=None):
+    latencies = []
+    errors = 0
+    totals = {"llm_calls": 0, "input_tokens": 0, "output_tokens": 0, "retries": 0, "failures": 0}
+    ttft = []
+    for _ in range(repeat):
+        metrics.reset()
+        start = time.perf_counter()
+        try:
+            pipeline.get_model_response(pipeline.MODEL, prompt, router=router)
+        except Exception as e:
+            errors += 1
+            print(f"{name}: run failed: {str(e)}", file=sys.stderr)
+        latencies.append(time.perf_counter() - start)
+
+        counters, series = metrics.snapshot()
+        totals["llm_calls"] += counter_total(counters, "llm_calls_total")
+        totals["input_tokens"] += counter_total(counters, "llm_input_tokens_total")
+        totals["output_tokens"] += counter_total(counters, "llm_output_tokens_total")
+        totals["retries"] += counter_total(counters, "llm_retries_total")
+        totals["failures"] += counter_total(counters, "llm_failures_total")
+        ttft.extend(p50 for series_name, _, _, _, p50, _ in series if series_name == "llm_ttft_seconds")
+
+    result = {
+        "document": name,
+        "prompt_tokens": pipeline.count_tokens(prompt),
+        "runs": repeat,
+        "errors": errors,
+        "p50_seconds": float(np.percentile(latencies, 50)),
+        "p95_seconds": float(np.percentile(latencies, 95)),
+        "ttft_p50_seconds": float(np.median(ttft)) if ttft else None,
+    }
+    # Per-run averages, so results with different --repeat stay comparable
+    result.update({key: value / repeat for key, value in totals.items()})
+    return result
+
+
+def compare(results, baseline, tolerance):
+    previous = {row["document"]: row for row in baseline["documents"]}
+    regressions = []
+    for row in results["documents"]:
+        before = previous.get(row["document"])
+        if before is None:
+            continue
+        for key in TRACKED:
+            if before[key] and row[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{row['document']}: {key} {before[key]:.3f} -> {row[key]:.3f}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run get_model_response against a local mock LLM server.")
+    parser.add_argument("--sizes-kb", type=int, nargs="+", default=[4, 32, 128, 512])
+    parser.add_argument("--corpus-dir", help="Use these documents instead of the synthetic corpus")
+    parser.add_argument("--pattern", default="*.txt")
+    parser.add_argument("--prompt", choices=["bulletin", "chat"], default="bulletin")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--output-tokens", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--embeddings-model", help="Route bulletin chunks to sections with this sentence-transformers model")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/pipeline-<timestamp>.json)")
+    parser.add_argument("--baseline", help="Earlier results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown against the baseline")
+    args = parser.parse_args()
+
+    server = MockLLMServer(args.latency, args.tokens_per_second, args.error_rate, args.output_tokens).start()
+
+    # The pipeline reads these on first use, so they must be set before it is imported
+    os.environ["LLM_BASE_URL"] = server.base_url
+    os.environ["LLM_CONCURRENCY"] = str(args.concurrency)
+    os.environ["LLM_CACHE_ENABLED"] = "0"
+    os.environ.setdefault("CHALLENGER_GENAI_API_KEY", "benchmark")
+    import summary_pipeline
+    from metrics import metrics
+
+    embeddings_model = None
+    if args.embeddings_model and args.prompt == "bulletin":
+        from sentence_transformers import SentenceTransformer
+        embeddings_model = SentenceTransformer(args.embeddings_model)
+
+    corpus = load_corpus(args)
+    with open(os.path.join(ROOT, "guided_questions.json")) as f:
+        guided_questions = json.load(f)
+    print(f"{'document':<24} {'tokens':>8} {'p50 s':>8} {'p95 s':>8} {'calls':>6} {'in tok':>9} {'out tok':>8} {'retries':>7}")
+    started = time.perf_counter()
+    rows = []
+    for name, document in corpus:
+        prompt = build_prompt(summary_pipeline, document, args.prompt, guided_questions)
+        router = build_router(summary_pipeline, document, embeddings_model) if embeddings_model is not None else None
+        row = run_document(summary_pipeline, metrics, name, prompt, args.repeat, router)
+        rows.append(row)
+        print(f"{name:<24} {row['prompt_tokens']:>8} {row['p50_seconds']:>8.2f} {row['p95_seconds']:>8.2f} "
+              f"{row['llm_calls']:>6.0f} {row['input_tokens']:>9.0f} {row['output_tokens']:>8.0f} {row['retries']:>7.1f}")
+    elapsed = time.perf_counter() - started
+    server.stop()
+
+    runs = len(rows) * args.repeat
+    results = {
+        "created": datetime.datetime.now().isoformat(timespec='seconds'),
+        "git_revision": git_revision(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "documents": rows,
+        "totals": {
+            "seconds": elapsed,
+            "documents_per_minute": runs / elapsed * 60,
+            "input_tokens_per_second": sum(row["input_tokens"] for row in rows) * args.repeat / elapsed,
+            "requests": server.requests,
+            "bytes_sent": server.bytes_received,
+        },
+    }
+    totals = results["totals"]
+    print(f"\n{runs} runs in {elapsed:.1f}s: {totals['documents_per_minute']:.1f} documents/min, "
+          f"{totals['input_tokens_per_second']:.0f} input tokens/s, {totals['bytes_sent'] / 1024:.0f} KB sent")
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results",
+                                         f"pipeline-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,88 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_chunking import make_document
+from mock_llm_server import MockLLMServer
+
+CHAT_PROMPT = "Based on the previous conversation and summary, please answer the following question:\n\nUser: What are the key requirements?\n\nAssistant:"
+
+
+def run_mixed_load(pipeline, scheduler, bulk_prompt, args, chat_priority):
+    """Run args.summaries bulk summaries for separate users while one chat user asks a question every args.chat_interval s.
+
+    Returns the chat latencies and the seconds the summaries took.
+    """
+    from llm_scheduler import BULK, request_context, set_scheduler
+
+    set_scheduler(scheduler)
+    stop = threading.Event()
+    chat_latencies = []
+
+    def summarize(user):
+        with request_context(user, BULK):
+            pipeline.get_model_response(pipeline.MODEL, bulk_prompt)
+
+    def chat():
+        with request_context("chat-user", chat_priority):
+            while not stop.wait(args.chat_interval):
+                start = time.perf_counter()
+                pipeline.get_model_response(pipeline.MODEL, CHAT_PROMPT)
+                chat_latencies.append(time.perf_counter() - start)
+
+    chat_thread = threading.Thread(target=chat, daemon=True)
+    chat_thread.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.summaries) as pool:
+        list(pool.map(summarize, [f"bulk-{i}" for i in range(args.summaries)]))
+    bulk_seconds = time.perf_counter() - start
+    stop.set()
+    chat_thread.join()
+    return chat_latencies, bulk_seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat latency while bulk summaries saturate the LLM scheduler.")
+    parser.add_argument("--summaries", type=int, default=4, help="Bulk summaries running at once, one user each")
+    parser.add_argument("--size-kb", type=int, default=256, help="Size of each summarized document")
+    parser.add_argument("--chat-interval", type=float, default=0.5, help="Seconds between chat questions")
+    parser.add_argument("--max-in-flight", type=int, default=8)
+    parser.add_argument("--reserved", type=int, default=2, help="Slots held back for interactive requests")
+    parser.add_argument("--tokens-per-minute", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--output-tokens", type=int, default=100)
+    args = parser.parse_args()
+
+    server = MockLLMServer(args.latency, args.tokens_per_second, 0.0, args.output_tokens).start()
+
+    # The pipeline reads these on first use, so they must be set before it is imported
+    os.environ["LLM_BASE_URL"] = server.base_url
+    os.environ["LLM_CONCURRENCY"] = str(args.max_in_flight)
+    os.environ["LLM_CACHE_ENABLED"] = "0"
+    os.environ.setdefault("CHALLENGER_GENAI_API_KEY", "benchmark")
+    import summary_pipeline
+    from llm_scheduler import BULK, INTERACTIVE, Scheduler
+
+    document = make_document(args.size_kb * 1024, seed=args.size_kb)
+    bulk_prompt = f"Summarize the following document.\n\nAttached File Content:\n{document}"
+    configs = [
+        # What LLM_MAX_IN_FLIGHT alone did: one shared cap, first come first served
+        ("shared cap only", Scheduler(args.max_in_flight, args.tokens_per_minute, 0), BULK),
+        ("chat priority", Scheduler(args.max_in_flight, args.tokens_per_minute, 0), INTERACTIVE),
+        (f"priority + {args.reserved} reserved", Scheduler(args.max_in_flight, args.tokens_per_minute, args.reserved), INTERACTIVE),
+    ]
+    print(f"{'configuration':<24} {'chats':>6} {'chat p50 s':>11} {'chat p95 s':>11} {'bulk s':>8}")
+    for name, scheduler, chat_priority in configs:
+        latencies, bulk_seconds = run_mixed_load(summary_pipeline, scheduler, bulk_prompt, args, chat_priority)
+        p50, p95 = (np.percentile(latencies, [50, 95]) if latencies else (float('nan'), float('nan')))
+        print(f"{name:<24} {len(latencies):>6} {p50:>11.2f} {p95:>11.2f} {bulk_seconds:>8.1f}")
+    server.stop()
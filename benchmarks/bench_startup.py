@@ -0,0 +1,72 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Each case runs in a fresh interpreter and prints its own elapsed seconds
+CASES = {
+    "import streamlit": "import streamlit",
+    "import app modules": (
+        "import streamlit, summary_pipeline, document_index, embedding_cache, corpus_index, "
+        "conversation, llm_transport, metrics"
+    ),
+    "first paint": (
+        "from streamlit.testing.v1 import AppTest\n"
+        "app = AppTest.from_file('app_st.py', default_timeout=120)\n"
+        "app.run()\n"
+        "assert not app.exception, app.exception"
+    ),
+}
+APP_MODULES = {"summary_pipeline", "document_index", "embedding_cache", "corpus_index", "conversation",
+               "llm_transport", "map_reduce", "metrics", "bulletin_sections", "text_chunking", "response_cache"}
+
+
+def time_case(code):
+    timed = f"import time\n_start = time.perf_counter()\n{code}\nprint(time.perf_counter() - _start)"
+    result = subprocess.run([sys.executable, "-c", timed], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed")
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(code, top):
+    # -X importtime reports cumulative microseconds per module on stderr
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        # Keep package roots (torch, pandas, ...) wherever they appear in the import tree
+        name = name.strip()
+        if cumulative_us.strip().isdigit() and "." not in name and not name.startswith("_"):
+            rows.append((int(cumulative_us), name))
+    return sorted(rows, reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold import time and first script run of the Streamlit app.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Slowest packages to list")
+    args = parser.parse_args()
+
+    baseline = None
+    print(f"{'case':<20} {'median s':>9} {'min s':>7} {'over streamlit':>15}")
+    for name, code in CASES.items():
+        try:
+            timings = [time_case(code) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"{name:<20} failed: {str(e)}")
+            continue
+        median = statistics.median(timings)
+        if baseline is None:
+            baseline = median
+        print(f"{name:<20} {median:>9.3f} {min(timings):>7.3f} {median - baseline:>+14.3f}s")
+
+    print("\nSlowest packages imported with the app modules (cumulative):")
+    for cumulative_us, module in slowest_imports(CASES["import app modules"], args.top):
+        marker = " (app)" if module in APP_MODULES else ""
+        print(f"  {cumulative_us / 1000:>8.1f} ms  {module}{marker}")
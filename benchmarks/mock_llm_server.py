@@ -0,0 +1,132 @@
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FILLER = ("the regulation requires manufacturers to register products with the authority before "
+          "import and to keep the declaration of conformity available for market surveillance").split()
+JSON_KEYS = re.compile(r'using exactly these keys: ((?:"[^"]+"(?:, )?)+)')
+
+
+class MockLLMServer:
+    """Local stand-in for the OpenAI-compatible chat completions endpoint.
+
+    Streams SSE deltas after `latency` seconds at `tokens_per_second`, and
+    answers a random `error_rate` share of requests with 503. Replies to
+    prompts that ask for a JSON object with fixed keys are valid JSON, so
+    the structured bulletin path is exercised too. Point LLM_BASE_URL at
+    `base_url` to use it.
+    """
+
+    def __init__(self, latency=0.2, tokens_per_second=200.0, error_rate=0.0, output_tokens=300, seed=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.output_tokens = output_tokens
+        self.requests = 0
+        self.errors = 0
+        self.bytes_received = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                server.handle(self, body)
+
+        class Server(ThreadingHTTPServer):
+            def handle_error(self, request, client_address):
+                # Clients dropping idle keep-alive connections is expected, not worth a traceback
+                if not isinstance(sys.exc_info()[1], ConnectionError):
+                    super().handle_error(request, client_address)
+
+        self._server = Server(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reply_tokens(self, request):
+        count = min(self.output_tokens, request.get('max_tokens') or self.output_tokens)
+        content = request['messages'][-1]['content']
+        match = JSON_KEYS.search(content)
+        if match is None:
+            return [f" {FILLER[i % len(FILLER)]}" for i in range(count)]
+        keys = re.findall(r'"([^"]+)"', match.group(1))
+        per_key = max(count // len(keys), 1)
+        reply = json.dumps({key: ' '.join(FILLER[i % len(FILLER)] for i in range(per_key)) for key in keys})
+        # Roughly four characters per token, like the real tokenizer on English text
+        return [reply[i:i + 4] for i in range(0, len(reply), 4)]
+
+    def handle(self, handler, body):
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += len(body)
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+
+        time.sleep(self.latency)
+        if failed:
+            payload = b'{"error": {"message": "Service temporarily unavailable"}}'
+            handler.send_response(503)
+            handler.send_header('Content-Type', 'application/json')
+            handler.send_header('Content-Length', str(len(payload)))
+            handler.end_headers()
+            handler.wfile.write(payload)
+            return
+
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/event-stream')
+        handler.send_header('Transfer-Encoding', 'chunked')
+        handler.end_headers()
+
+        def send(data):
+            handler.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            handler.wfile.flush()
+
+        # Emit in 20 ms bursts so high token rates are not limited by sleep granularity
+        start = time.perf_counter()
+        tokens = self.reply_tokens(json.loads(body))
+        sent = 0
+        while sent < len(tokens):
+            due = min(len(tokens), max(sent + 1, int((time.perf_counter() - start) * self.tokens_per_second)))
+            send(b''.join(
+                b'data: ' + json.dumps({'choices': [{'delta': {'content': token}}]}).encode() + b'\n\n'
+                for token in tokens[sent:due]
+            ))
+            sent = due
+            if sent < len(tokens):
+                time.sleep(0.02)
+        # Final event and chunked-encoding terminator in one write, so a client that stops at [DONE] has it all
+        done = b'data: [DONE]\n\n'
+        handler.wfile.write(b'%x\r\n%s\r\n0\r\n\r\n' % (len(done), done))
+        handler.wfile.flush()
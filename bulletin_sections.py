@@ -0,0 +1,221 @@
+import re
+from collections import Counter
+from typing import Optional
+
+import orjson
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+# Bulletin sections in the order they are rendered, and how partial answers are merged:
+# "date" and "label" fields are merged locally by vote, "narrative" fields need the LLM
+SECTIONS = [
+    ("Program Requirements Summary", "narrative"),
+    ("Regulation Publication Date", "date"),
+    ("Enforcement Date", "date"),
+    ("Enforcement based on", "label"),
+    ("Compliance Checkpoint", "label"),
+    ("Regulation Status", "label"),
+    ("Current process", "narrative"),
+    ("Changes from current process", "narrative"),
+    ("Key Details/Legislation Requirement", "narrative"),
+    ("Requirement", "narrative"),
+    ("Dependency", "label"),
+    ("Details of Requirement", "narrative"),
+    ("Wireless Technology Scope", "label"),
+    ("Detail Requirements", "narrative"),
+]
+NARRATIVE_SECTIONS = [name for name, kind in SECTIONS if kind == "narrative"]
+
+EMPTY_VALUES = {"", "n/a", "na", "none", "null", "not applicable", "not available", "unknown", "tbd",
+                "information not available in this chunk", "information not available in this chunk."}
+
+
+def json_instructions(names):
+    return (
+        "Respond only with a single JSON object using exactly these keys: "
+        + ", ".join(f'"{name}"' for name in names)
+        + ". Each value must be a string, or null if this part of the document has no information for that section."
+    )
+
+
+JSON_INSTRUCTIONS = json_instructions(name for name, _ in SECTIONS)
+
+
+def normalize_value(value):
+    if value is None:
+        return None
+    if isinstance(value, list):
+        value = "\n".join(str(item) for item in value)
+    value = str(value).strip()
+    return None if value.lower() in EMPTY_VALUES else value
+
+
+def _field(name):
+    return Field(default=None, alias=name)
+
+
+class BulletinSections(BaseModel):
+    model_config = ConfigDict(populate_by_name=True, extra='ignore')
+
+    program_requirements_summary: Optional[str] = _field("Program Requirements Summary")
+    regulation_publication_date: Optional[str] = _field("Regulation Publication Date")
+    enforcement_date: Optional[str] = _field("Enforcement Date")
+    enforcement_based_on: Optional[str] = _field("Enforcement based on")
+    compliance_checkpoint: Optional[str] = _field("Compliance Checkpoint")
+    regulation_status: Optional[str] = _field("Regulation Status")
+    current_process: Optional[str] = _field("Current process")
+    changes_from_current_process: Optional[str] = _field("Changes from current process")
+    key_details: Optional[str] = _field("Key Details/Legislation Requirement")
+    requirement: Optional[str] = _field("Requirement")
+    dependency: Optional[str] = _field("Dependency")
+    details_of_requirement: Optional[str] = _field("Details of Requirement")
+    wireless_technology_scope: Optional[str] = _field("Wireless Technology Scope")
+    detail_requirements: Optional[str] = _field("Detail Requirements")
+
+    @field_validator('*', mode='before')
+    @classmethod
+    def normalize_empty(cls, value):
+        return normalize_value(value)
+
+    def by_section(self):
+        return self.model_dump(by_alias=True)
+
+
+def parse_sections(text):
+    """Parse one map-stage reply into BulletinSections, or None if it is not valid JSON for the schema."""
+    start = text.find('{')
+    end = text.rfind('}')
+    if start < 0 or end <= start:
+        return None
+    try:
+        return BulletinSections.model_validate(orjson.loads(text[start:end + 1]))
+    except (orjson.JSONDecodeError, ValidationError):
+        return None
+
+
+def _vote(values):
+    # Most frequent answer wins; ties go to the one seen first in document order
+    normalized = [re.sub(r'\s+', ' ', value).strip().rstrip('.') for value in values]
+    counts = Counter(value.lower() for value in normalized)
+    best = max(counts.values())
+    return next(value for value in normalized if counts[value.lower()] == best)
+
+
+def merge_sections(extractions):
+    """Merge per-chunk extractions in document order.
+
+    Returns the merged sections and, for narrative sections with more than one
+    distinct candidate, the candidates that still need an LLM reduce.
+    """
+    merged = {}
+    pending = {}
+    answers = [extraction.by_section() for extraction in extractions]
+    for name, kind in SECTIONS:
+        values = [answer[name] for answer in answers]
+        values = [value for value in values if value]
+        if not values:
+            merged[name] = None
+        elif kind != "narrative":
+            merged[name] = _vote(values)
+        else:
+            distinct = list(dict.fromkeys(values))
+            if len(distinct) == 1:
+                merged[name] = distinct[0]
+            else:
+                merged[name] = None
+                pending[name] = distinct
+    return merged, pending
+
+
+def render_section(number, name, value):
+    return f"**{number}) {name}:** {value or 'Not applicable'}"
+
+
+def render_sections(merged):
+    return "\n\n".join(render_section(number, name, merged.get(name)) for number, (name, _) in enumerate(SECTIONS, start=1))
+
+
+JSON_STRING = re.compile(r'"((?:[^"\\]|\\.)*)(")?', re.DOTALL)
+PARTIAL_ESCAPE = re.compile(r'\\u[0-9a-fA-F]{0,3}$')
+
+
+def _decode_partial(raw):
+    # raw is the inside of a JSON string that may be cut off mid-escape
+    try:
+        return orjson.loads(f'"{raw}"')
+    except orjson.JSONDecodeError:
+        try:
+            return orjson.loads(f'"{PARTIAL_ESCAPE.sub("", raw)}"')
+        except orjson.JSONDecodeError:
+            return raw
+
+
+class SectionStream:
+    """Sink that renders the narrative reduce's streamed JSON reply as bulletin sections.
+
+    Sections are written to the target sink in bulletin order: locally merged
+    sections at once, and each pending section as its value streams in, up to
+    the first pending section the reply has not finished yet. The reply is
+    expected to list the pending keys in bulletin order.
+    """
+
+    def __init__(self, target, merged, pending):
+        self.target = target
+        self.merged = merged
+        self.pending = list(pending)
+        self._keys = [re.compile(r'"' + re.escape(name) + r'"\s*:\s*') for name in self.pending]
+        self.reset()
+
+    @property
+    def text(self):
+        return self._written
+
+    def reset(self):
+        self._reply = ""
+        self._values = {}  # Pending sections the reply has finished
+        self._position = 0  # Where the reply's next key is looked for
+        self._written = ""
+        self.target.reset()
+        self._render(None)
+
+    def write(self, delta):
+        self._reply += delta
+        partial = None
+        while len(self._values) < len(self.pending):
+            name = self.pending[len(self._values)]
+            key = self._keys[len(self._values)].search(self._reply, self._position)
+            if key is None:
+                break
+            if self._reply.startswith('null', key.end()):
+                self._values[name] = None
+                self._position = key.end() + 4
+                continue
+            value = JSON_STRING.match(self._reply, key.end())
+            if value is None:
+                break
+            if value.group(2) is None:
+                partial = _decode_partial(value.group(1))
+                break
+            self._values[name] = normalize_value(_decode_partial(value.group(1)))
+            self._position = value.end()
+        self._render(partial)
+
+    def _render(self, partial):
+        blocks = []
+        for number, (name, _) in enumerate(SECTIONS, start=1):
+            if name not in self.pending:
+                blocks.append(render_section(number, name, self.merged.get(name)))
+            elif name in self._values:
+                blocks.append(render_section(number, name, self._values[name]))
+            else:
+                if partial:
+                    blocks.append(f"**{number}) {name}:** {partial}")
+                break
+        text = "\n\n".join(blocks)
+        # Everything rendered so far only grows, so normally just the new tail is written
+        if text.startswith(self._written):
+            if len(text) > len(self._written):
+                self.target.write(text[len(self._written):])
+        else:
+            self.target.reset()
+            self.target.write(text)
+        self._written = text
@@ -0,0 +1,125 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current = ContextVar("cancel_token", default=None)
+
+
+class Cancelled(Exception):
+    """Raised inside LLM work that was cancelled or has run past its deadline."""
+
+
+class DeadlineExceeded(Cancelled):
+    pass
+
+
+class CancelToken:
+    """Cancellation flag and optional deadline shared by every LLM call of one piece of work.
+
+    A token created inside another token's scope is cancelled along with it
+    and never has a later deadline, so a job's cancellation and a summary's
+    deadline reach each map and reduce call, in whatever thread it runs.
+    """
+
+    def __init__(self, timeout=None, parent=None):
+        self.parent = parent
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        if parent is not None and parent.deadline is not None:
+            self.deadline = parent.deadline if self.deadline is None else min(self.deadline, parent.deadline)
+        self.reason = None
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def cancel(self, reason="cancelled"):
+        self.reason = reason
+        with self._lock:
+            self._event.set()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """Call callback (from whichever thread) when this token or a parent is cancelled or the deadline passes.
+
+        Called at once if that has already happened, and possibly more than
+        once. Returns a function that unregisters it.
+        """
+        chain = []
+        token = self
+        while token is not None:
+            chain.append(token)
+            token = token.parent
+        fired = False
+        for token in chain:
+            with token._lock:
+                fired = fired or token._event.is_set()
+                token._callbacks.append(callback)
+        timer = None
+        if self.deadline is not None:
+            timer = threading.Timer(max(self.remaining(), 0), callback)
+            timer.daemon = True
+            timer.start()
+        if fired:
+            callback()
+
+        def unregister():
+            for token in chain:
+                with token._lock:
+                    if callback in token._callbacks:
+                        token._callbacks.remove(callback)
+            if timer is not None:
+                timer.cancel()
+        return unregister
+
+    @property
+    def cancel_requested(self):
+        # Cancelled explicitly, here or in a parent, as opposed to running out of time
+        token = self
+        while token is not None:
+            if token._event.is_set():
+                return True
+            token = token.parent
+        return False
+
+    def remaining(self):
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def check(self):
+        if self.cancel_requested:
+            token = self
+            while not token._event.is_set():
+                token = token.parent
+            raise Cancelled(f"Request {token.reason}")
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise DeadlineExceeded("Request deadline exceeded")
+
+
+@contextmanager
+def cancel_scope(timeout=None, token=None):
+    """Run the block under token, or under a new child of the current token that expires after timeout seconds."""
+    if token is None:
+        token = CancelToken(timeout, parent=_current.get())
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+
+
+def current_token():
+    return _current.get()
+
+
+def check_cancelled():
+    token = _current.get()
+    if token is not None:
+        token.check()
+
+
+def time_left(timeout):
+    # timeout, shortened to what is left before the current deadline
+    token = _current.get()
+    remaining = token.remaining() if token is not None else None
+    return timeout if remaining is None else max(min(timeout, remaining), 0)
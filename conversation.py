@@ -0,0 +1,34 @@
+def make_message(role, content, tokenizer):
+    # Token count is computed once here and carried with the message from then on
+    return {"role": role, "content": content, "tokens": len(tokenizer.encode_ordinary(content))}
+
+
+def message_tokens(message, tokenizer):
+    if 'tokens' not in message:
+        message['tokens'] = len(tokenizer.encode_ordinary(message['content']))
+    return message['tokens']
+
+
+def pack_history(messages, max_tokens, tokenizer):
+    """Select the most recent messages that fit in max_tokens, oldest first.
+
+    Uses the cached per-message counts, so the cost is linear in the number
+    of messages kept. The oldest kept message is truncated if only part of it fits.
+    """
+    packed = []
+    remaining = max_tokens
+
+    for message in reversed(messages):
+        if remaining <= 0:
+            break
+        tokens = message_tokens(message, tokenizer)
+        if tokens <= remaining:
+            packed.append(message)
+            remaining -= tokens
+        else:
+            truncated = tokenizer.decode(tokenizer.encode_ordinary(message['content'])[:remaining])
+            packed.append({"role": message['role'], "content": truncated, "tokens": remaining})
+            break
+
+    packed.reverse()
+    return packed
@@ -0,0 +1,199 @@
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+from document_index import chunk_offsets
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "corpus.faiss"
+METADATA_FILE = "corpus.json"
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+
+
+def decode_with_offsets(data):
+    """Decode UTF-8 bytes, dropping invalid bytes and keeping line endings as stored.
+
+    Also returns the byte offset in data of every character position of the
+    text (plus its end), so chunk offsets map back to the raw file exactly.
+    """
+    escaped = data.decode('utf-8', errors='surrogateescape')
+    code_points = np.frombuffer(escaped.encode('utf-32-le', errors='surrogatepass'), dtype=np.uint32)
+    # surrogateescape turns each invalid byte into one of U+DC80..U+DCFF
+    invalid = (code_points >= 0xDC80) & (code_points <= 0xDCFF)
+    byte_lengths = np.where(invalid, 1, 1 + (code_points >= 0x80) + (code_points >= 0x800) + (code_points >= 0x10000))
+    byte_starts = np.zeros(len(code_points) + 1, dtype=np.int64)
+    np.cumsum(byte_lengths, out=byte_starts[1:])
+    kept = np.append(~invalid, True)
+    text = data.decode('utf-8', errors='ignore') if invalid.any() else escaped
+    return text, byte_starts[kept]
+
+
+class CorpusIndex:
+    """FAISS HNSW index over chunks of the historical bulletin corpus.
+
+    HNSW needs no training step, so new or changed bulletins are appended
+    with add_document without rebuilding. Chunks of a bulletin that has
+    since changed stay in the graph but are filtered out at query time.
+    """
+
+    def __init__(self, index_dir, dimension=None):
+        self.index_dir = index_dir
+        index_path = os.path.join(index_dir, INDEX_FILE)
+        metadata_path = os.path.join(index_dir, METADATA_FILE)
+        exists = os.path.exists(index_path) and os.path.exists(metadata_path)
+        if not exists and dimension is None:
+            raise FileNotFoundError(f"No corpus index found in {index_dir}")
+
+        # Imported here so the app does not pay for faiss until an index is actually loaded
+        import faiss
+
+        if exists:
+            self.index = faiss.read_index(index_path)
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+            self.documents = metadata['documents']
+            self.chunks = metadata['chunks']
+        else:
+            self.index = faiss.IndexHNSWFlat(dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            self.index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            self.documents = {}
+            self.chunks = []
+
+        faiss.downcast_index(self.index).hnsw.efSearch = HNSW_EF_SEARCH
+
+    @classmethod
+    def load(cls, index_dir):
+        try:
+            return cls(index_dir)
+        except FileNotFoundError:
+            return None
+
+    def __len__(self):
+        return self.index.ntotal
+
+    def add_document(self, name, path, tokenizer, embeddings_model, max_tokens=800, batch_size=64):
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        previous = self.documents.get(name)
+        if previous is not None and previous['sha256'] == digest:
+            return 0
+
+        text, byte_offsets = decode_with_offsets(data)
+        char_offsets, _ = chunk_offsets(text, tokenizer, max_tokens)
+        chunks = [text[start:end] for start, end in char_offsets]
+        if not chunks:
+            return 0
+
+        embeddings = embeddings_model.encode(
+            chunks,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        ).astype(np.float32, copy=False)
+        self.index.add(embeddings)
+
+        # Record byte offsets into the file as stored, so query results can be read back with a single seek
+        version = previous['version'] + 1 if previous is not None else 0
+        for start, end in char_offsets:
+            byte_start = int(byte_offsets[start])
+            self.chunks.append([name, version, byte_start, int(byte_offsets[end]) - byte_start])
+
+        self.documents[name] = {'path': os.path.abspath(path), 'sha256': digest, 'version': version}
+        return len(chunks)
+
+    def save(self):
+        import faiss
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        index_path = os.path.join(self.index_dir, INDEX_FILE)
+        metadata_path = os.path.join(self.index_dir, METADATA_FILE)
+        faiss.write_index(self.index, index_path + '.tmp')
+        with open(metadata_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'documents': self.documents, 'chunks': self.chunks}, f)
+        os.replace(index_path + '.tmp', index_path)
+        os.replace(metadata_path + '.tmp', metadata_path)
+
+    def read_chunk(self, row):
+        name, _, byte_start, byte_length = self.chunks[row]
+        with open(self.documents[name]['path'], 'rb') as f:
+            f.seek(byte_start)
+            return f.read(byte_length).decode('utf-8', errors='ignore')
+
+    def search(self, query_embedding, top_k=5):
+        if self.index.ntotal == 0:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+        # Over-fetch so stale chunks of changed bulletins can be dropped
+        scores, rows = self.index.search(query, min(top_k * 4, self.index.ntotal))
+
+        results = []
+        for score, row in zip(scores[0], rows[0]):
+            if row < 0:
+                continue
+            name, version = self.chunks[row][:2]
+            if self.documents[name]['version'] != version:
+                continue
+            results.append({'filename': name, 'row': int(row), 'score': float(score)})
+            if len(results) == top_k:
+                break
+        return results
+
+    def similar_bulletins(self, query_embedding, top_k=3):
+        # Best chunk score per bulletin, so one long bulletin cannot fill every slot
+        best = {}
+        for result in self.search(query_embedding, top_k=top_k * 4):
+            if result['filename'] not in best:
+                best[result['filename']] = result
+            if len(best) == top_k:
+                break
+        return list(best.values())
+
+
+def build_corpus_index(corpus_dir, index_dir, tokenizer, embeddings_model, pattern='*_docx.txt', max_tokens=800):
+    paths = sorted(glob.glob(os.path.join(corpus_dir, pattern)))
+    corpus_index = CorpusIndex.load(index_dir)
+    if corpus_index is None:
+        corpus_index = CorpusIndex(index_dir, dimension=embeddings_model.get_sentence_embedding_dimension())
+
+    added = 0
+    for path in paths:
+        count = corpus_index.add_document(os.path.basename(path), path, tokenizer, embeddings_model, max_tokens=max_tokens)
+        if count:
+            logger.info(f"Indexed {count} chunks from {os.path.basename(path)}")
+        added += count
+
+    corpus_index.save()
+    logger.info(f"Corpus index has {len(corpus_index)} chunks from {len(corpus_index.documents)} bulletins ({added} new)")
+    return corpus_index
+
+
+if __name__ == "__main__":
+    import tiktoken
+    from sentence_transformers import SentenceTransformer
+
+    parser = argparse.ArgumentParser(description="Build or update the FAISS index over past bulletins.")
+    parser.add_argument("corpus_dir", help="Directory containing the bulletin text files")
+    parser.add_argument("--index-dir", default=os.environ.get("CORPUS_INDEX_DIR", ".cache/corpus_index"))
+    parser.add_argument("--pattern", default="*_docx.txt")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--max-tokens", type=int, default=800)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    build_corpus_index(
+        args.corpus_dir,
+        args.index_dir,
+        tiktoken.get_encoding("cl100k_base"),
+        SentenceTransformer(args.model),
+        pattern=args.pattern,
+        max_tokens=args.max_tokens,
+    )
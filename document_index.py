@@ -0,0 +1,155 @@
+import re
+
+import numpy as np
+
+from text_chunking import chunk_spans
+
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+|\s*\n\s*')  # Sentence ends and line breaks (CSV rows, list items)
+MAX_SENTENCE_CHARS = 1000  # About the 256 tokens all-MiniLM-L6-v2 embeds; longer runs are split
+
+
+def sentence_spans(text, max_chars=MAX_SENTENCE_CHARS):
+    # (start, end) offsets of the sentences and lines of text, none longer than max_chars
+    spans = []
+    start = 0
+    for match in SENTENCE_SPLIT.finditer(text):
+        spans.extend(split_long_span(text, start, match.start(), max_chars))
+        start = match.end()
+    spans.extend(split_long_span(text, start, len(text), max_chars))
+    return spans
+
+
+def split_long_span(text, start, end, max_chars):
+    # Cut at the last space within max_chars, or hard at max_chars if there is none
+    spans = []
+    while end - start > max_chars:
+        cut = text.rfind(' ', start + 1, start + max_chars + 1)
+        cut = cut if cut > start else start + max_chars
+        spans.append((start, cut))
+        start = cut + 1 if text[cut] == ' ' else cut
+    spans.append((start, end))
+    return spans
+
+
+def chunk_offsets(text, tokenizer, max_tokens, overlap=0):
+    spans = chunk_spans(text, tokenizer, max_tokens, overlap)
+    char_offsets = np.asarray([(span.start, span.end) for span in spans], dtype=np.int64).reshape(-1, 2)
+    token_offsets = np.asarray([(span.token_start, span.token_end) for span in spans], dtype=np.int64).reshape(-1, 2)
+    return char_offsets, token_offsets
+
+
+def top_k_indices(scores, top_k):
+    # argpartition is O(n); only the k winners get sorted
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(scores, -top_k)[-top_k:]
+    return top[np.argsort(scores[top])[::-1]]
+
+
+def encode_normalized(embeddings_model, texts, batch_size=64):
+    return embeddings_model.encode(
+        texts,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+    ).astype(np.float32, copy=False)
+
+
+class DocumentIndex:
+    """Chunks of an attached document and their normalized embeddings, built once per upload."""
+
+    def __init__(self, text, char_offsets, token_offsets, embeddings):
+        self.text = text
+        self.char_offsets = char_offsets
+        self.token_offsets = token_offsets
+        self.embeddings = embeddings
+
+    @classmethod
+    def build(cls, text, tokenizer, embeddings_model, max_tokens=800, batch_size=64, cache=None):
+        if cache is not None:
+            key = cache.key(text, chunker='tokens', max_tokens=max_tokens)
+            cached = cache.get(key)
+            if cached is not None:
+                offsets, embeddings = cached
+                return cls(text, offsets[:, :2], offsets[:, 2:], embeddings)
+
+        char_offsets, token_offsets = chunk_offsets(text, tokenizer, max_tokens)
+        chunks = [text[start:end] for start, end in char_offsets]
+        embeddings = encode_normalized(embeddings_model, chunks, batch_size)
+
+        if cache is not None:
+            cache.put(key, np.hstack([char_offsets, token_offsets]), embeddings)
+
+        return cls(text, char_offsets, token_offsets, embeddings)
+
+    def __len__(self):
+        return len(self.char_offsets)
+
+    def chunk(self, i):
+        start, end = self.char_offsets[i]
+        return self.text[start:end]
+
+    def chunk_tokens(self, i):
+        start, end = self.token_offsets[i]
+        return int(end - start)
+
+    def top_indices(self, query_embedding, top_k=1):
+        # Embeddings are unit length, so the dot product is the cosine similarity
+        scores = self.embeddings @ np.asarray(query_embedding, dtype=np.float32).ravel()
+        return top_k_indices(scores, top_k)
+
+    def centroid(self):
+        # Mean chunk direction, a cheap single-vector summary of the whole document
+        mean = np.asarray(self.embeddings, dtype=np.float32).mean(axis=0)
+        norm = np.linalg.norm(mean)
+        return mean / norm if norm > 0 else mean
+
+    def search(self, query, embeddings_model, top_k=1):
+        query_embedding = embeddings_model.encode(query, convert_to_numpy=True, normalize_embeddings=True)
+        return [self.chunk(i) for i in self.top_indices(query_embedding, top_k)]
+
+
+class SentenceIndex:
+    """Sentence spans of a document, stored as offsets into its text, with one embedding per sentence."""
+
+    def __init__(self, text, spans, embeddings):
+        self.text = text
+        self.spans = spans
+        self.embeddings = embeddings
+
+    @classmethod
+    def build(cls, text, embeddings_model, batch_size=128, cache=None):
+        if cache is not None:
+            key = cache.key(text, chunker='sentence_index', max_chars=MAX_SENTENCE_CHARS)
+            cached = cache.get(key)
+            if cached is not None:
+                spans, embeddings = cached
+                return cls(text, spans, embeddings)
+
+        spans = np.asarray(
+            [(start, end) for start, end in sentence_spans(text) if text[start:end].strip()],
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        if len(spans):
+            embeddings = encode_normalized(embeddings_model, [text[start:end] for start, end in spans], batch_size)
+        else:
+            embeddings = np.empty((0, embeddings_model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        if cache is not None:
+            cache.put(key, spans, embeddings)
+
+        return cls(text, spans, embeddings)
+
+    def __len__(self):
+        return len(self.spans)
+
+    def sentence(self, i):
+        start, end = self.spans[i]
+        return self.text[start:end]
+
+    def relevant_context(self, query_embedding, top_k=3):
+        scores = self.embeddings @ np.asarray(query_embedding, dtype=np.float32).ravel()
+        # Keep the winning sentences in reading order
+        top = np.sort(top_k_indices(scores, top_k))
+        return ' '.join(self.sentence(i) for i in top)
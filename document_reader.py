@@ -0,0 +1,159 @@
+import csv
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+SUPPORTED_EXTENSIONS = ('.txt', '.docx', '.pdf', '.csv')
+READ_BLOCK = 1024 * 1024
+PDF_PAGES_PER_TASK = 4  # Pages extracted per worker task
+PDF_TASKS_PER_WORKER = 2  # Page batches in flight per worker; bounds memory regardless of page count
+
+WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+DOCX_HEADER = re.compile(r'word/header[0-9]*\.xml')
+DOCX_FOOTER = re.compile(r'word/footer[0-9]*\.xml')
+
+_pdf_file = None
+_pdf_reader = None
+
+
+def spool_upload(file, directory=None):
+    """Copy an uploaded file object to a temporary file in fixed-size blocks and return its path.
+
+    The caller removes the file when done.
+    """
+    suffix = os.path.splitext(getattr(file, 'name', ''))[1].lower()
+    file.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=directory) as spooled:
+        shutil.copyfileobj(file, spooled, READ_BLOCK)
+    return spooled.name
+
+
+def _open_pdf(path):
+    # Worker initializer: each process keeps its own reader over the file on disk
+    global _pdf_file, _pdf_reader
+    import PyPDF2
+    _pdf_file = open(path, 'rb')
+    _pdf_reader = PyPDF2.PdfReader(_pdf_file)
+
+
+def _extract_pages(start, stop):
+    return [_pdf_reader.pages[i].extract_text() or '' for i in range(start, stop)]
+
+
+def iter_pdf_pages(path, workers=None):
+    """Yield the text of each PDF page in page order.
+
+    Pages are extracted in batches across a process pool, with only a few
+    batches in flight per worker, so memory stays proportional to the
+    number of workers rather than the number of pages. workers=1 extracts
+    in the calling process.
+    """
+    import PyPDF2
+
+    # Pass a file object: given a path, PdfReader reads the whole file into memory
+    with open(path, 'rb') as f:
+        page_count = len(PyPDF2.PdfReader(f).pages)
+        workers = min(workers or os.cpu_count() or 1, -(-page_count // PDF_PAGES_PER_TASK))
+        if workers <= 1:
+            reader = PyPDF2.PdfReader(f)
+            for page in reader.pages:
+                yield page.extract_text() or ''
+            return
+
+    batches = iter(range(0, page_count, PDF_PAGES_PER_TASK))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_open_pdf, initargs=(path,)) as pool:
+        pending = deque()
+
+        def submit_next():
+            start = next(batches, None)
+            if start is not None:
+                pending.append(pool.submit(_extract_pages, start, min(start + PDF_PAGES_PER_TASK, page_count)))
+
+        for _ in range(workers * PDF_TASKS_PER_WORKER):
+            submit_next()
+        while pending:
+            texts = pending.popleft().result()
+            submit_next()
+            yield from texts
+
+
+def _iter_word_xml(stream):
+    # Same text as docx2txt.xml2text, produced paragraph by paragraph while the XML is parsed
+    pieces = []
+    for event, element in ElementTree.iterparse(stream, events=('start', 'end')):
+        tag = element.tag
+        if event == 'start':
+            if tag == WORD_NAMESPACE + 'p':
+                yield ''.join(pieces)
+                pieces = ['\n\n']
+            elif tag == WORD_NAMESPACE + 'tab':
+                pieces.append('\t')
+            elif tag in (WORD_NAMESPACE + 'br', WORD_NAMESPACE + 'cr'):
+                pieces.append('\n')
+        elif tag == WORD_NAMESPACE + 't':
+            pieces.append(element.text or '')
+        elif tag == WORD_NAMESPACE + 'p':
+            element.clear()
+    yield ''.join(pieces)
+
+
+def iter_docx_text(path):
+    with zipfile.ZipFile(path) as archive:
+        names = archive.namelist()
+        parts = ([name for name in names if DOCX_HEADER.match(name)] + ['word/document.xml']
+                 + [name for name in names if DOCX_FOOTER.match(name)])
+        for name in parts:
+            with archive.open(name) as stream:
+                yield from _iter_word_xml(stream)
+
+
+def _strip_stream(pieces):
+    # str.strip() over a stream: drop leading whitespace and hold trailing whitespace until more text arrives
+    started = False
+    pending = ''
+    for piece in pieces:
+        if not started:
+            piece = piece.lstrip()
+            if not piece:
+                continue
+            started = True
+        stripped = piece.rstrip()
+        if stripped:
+            yield pending + stripped
+            pending = piece[len(stripped):]
+        else:
+            pending += piece
+
+
+def iter_document_text(path, filename=None, workers=None):
+    """Yield the text of a .txt, .docx, .pdf or .csv file as ordered pieces.
+
+    Joining the pieces gives the full document text. filename, if given,
+    decides the format instead of path (e.g. for spooled uploads).
+    """
+    file_extension = os.path.splitext(filename or path)[1].lower()
+
+    if file_extension == '.txt':
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            for block in iter(lambda: f.read(READ_BLOCK), ''):
+                yield block
+    elif file_extension == '.docx':
+        yield from _strip_stream(iter_docx_text(path))
+    elif file_extension == '.pdf':
+        for page_number, text in enumerate(iter_pdf_pages(path, workers)):
+            yield text if page_number == 0 else ' ' + text
+    elif file_extension == '.csv':
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            for row_number, row in enumerate(csv.reader(f)):
+                yield ','.join(row) if row_number == 0 else '\n' + ','.join(row)
+    else:
+        raise ValueError("Unsupported file format")
+
+
+def read_document(path, filename=None, workers=None):
+    return ''.join(iter_document_text(path, filename, workers))
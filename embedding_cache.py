@@ -0,0 +1,92 @@
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """On-disk, content-addressed store of chunk offsets and embeddings.
+
+    Entries are plain .npy files opened with mmap_mode='r', so every worker
+    process reading the same document shares the OS page cache. The least
+    recently used entries are evicted once the directory exceeds max_bytes.
+    """
+
+    def __init__(self, directory, model_name, max_bytes=512 * 1024 * 1024, dtype=np.float32):
+        self.directory = directory
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, text, **params):
+        digest = hashlib.sha256()
+        digest.update(text.encode('utf-8'))
+        digest.update(self.model_name.encode('utf-8'))
+        digest.update(self.dtype.str.encode('utf-8'))
+        for name in sorted(params):
+            digest.update(f"|{name}={params[name]}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def _paths(self, key):
+        return (os.path.join(self.directory, f"{key}.offsets.npy"),
+                os.path.join(self.directory, f"{key}.embeddings.npy"))
+
+    def get(self, key):
+        offsets_path, embeddings_path = self._paths(key)
+        try:
+            offsets = np.load(offsets_path, mmap_mode='r')
+            embeddings = np.load(embeddings_path, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            metrics.increment("embedding_cache_lookups_total", result="miss")
+            return None
+        metrics.increment("embedding_cache_lookups_total", result="hit")
+        # Touch both files so eviction sees them as recently used
+        for path in (offsets_path, embeddings_path):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return offsets, embeddings
+
+    def put(self, key, offsets, embeddings):
+        for path, array in zip(self._paths(key), (np.asarray(offsets, dtype=np.int64), np.asarray(embeddings, dtype=self.dtype))):
+            # Write to a temp file and rename so readers never see a partial array
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.save(f, array)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        self.evict()
+
+    def evict(self):
+        # Group the offsets/embeddings pair of each key so entries are evicted whole
+        entries = {}
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith('.npy'):
+                stat = entry.stat()
+                key = entry.name.split('.', 1)[0]
+                last_used, size, paths = entries.get(key, (0.0, 0, []))
+                entries[key] = (max(last_used, stat.st_mtime), size + stat.st_size, paths + [entry.path])
+
+        total = sum(size for _, size, _ in entries.values())
+        for key, (_, size, paths) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            logger.info(f"Evicted embedding cache entry {key}")
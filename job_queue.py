@@ -0,0 +1,166 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from cancellation import CancelToken, Cancelled, DeadlineExceeded, cancel_scope
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "8"))  # Jobs running at once; the LLM scheduler caps their requests
+JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_SECONDS", "3600"))  # How long finished jobs stay retrievable
+JOB_ABANDON_SECONDS = int(os.environ.get("JOB_ABANDON_SECONDS", "60"))  # Unfinished jobs nobody has looked at for this long are cancelled
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+class Job:
+    """One background call, with the streamed text and progress it has produced so far.
+
+    A Job is the sink and progress callback passed to the function it runs,
+    so the pipeline writes into it exactly as it would into the UI.
+    """
+
+    def __init__(self, job_id, kind, metadata):
+        self.id = job_id
+        self.kind = kind
+        self.metadata = metadata
+        self.status = QUEUED
+        self.created = time.time()
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.progress = None  # (done, total, tokens, elapsed) of the map step, if any
+        self.token = CancelToken()
+        self.last_seen = self.created
+        self._pieces = []
+        self._lock = threading.Lock()
+
+    # Sink interface used by get_model_response
+    def reset(self):
+        with self._lock:
+            self._pieces = []
+
+    def write(self, delta):
+        with self._lock:
+            self._pieces.append(delta)
+
+    def on_progress(self, done, total, tokens, elapsed):
+        self.progress = (done, total, tokens, elapsed)
+
+    @property
+    def text(self):
+        with self._lock:
+            return ''.join(self._pieces)
+
+    @property
+    def is_finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+
+class JobQueue:
+    """Process-wide pool of background jobs, looked up by id.
+
+    Jobs keep running across script reruns and browser refreshes, and
+    finished jobs stay retrievable for ttl seconds. A job that has not been
+    looked up for abandon_after seconds (its session went away) is
+    cancelled, which stops its LLM requests.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, ttl=JOB_TTL_SECONDS, abandon_after=JOB_ABANDON_SECONDS):
+        self.ttl = ttl
+        self.abandon_after = abandon_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._reaper = threading.Thread(target=self._reap, name="job-reaper", daemon=True)
+        self._reaper.start()
+
+    def submit(self, kind, fn, *args, **metadata):
+        """Run fn(*args, sink=job, on_progress=job.on_progress) in the background and return the job id."""
+        job = Job(uuid.uuid4().hex, kind, metadata)
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+        metrics.increment("jobs_submitted_total", kind=kind)
+        self._executor.submit(self._run, job, fn, args)
+        return job.id
+
+    def _run(self, job, fn, args):
+        metrics.observe("job_queue_seconds", time.time() - job.created, kind=job.kind)
+        try:
+            # Every LLM call the job makes, in any thread, runs under its token
+            with cancel_scope(token=job.token):
+                job.token.check()
+                job.status = RUNNING
+                job.result = fn(*args, sink=job, on_progress=job.on_progress)
+            job.status = DONE
+        except Cancelled as e:
+            if isinstance(e, DeadlineExceeded):
+                logger.error(f"Job {job.id} ({job.kind}) failed: {str(e)}")
+            job.error = str(e)
+            job.status = FAILED if isinstance(e, DeadlineExceeded) else CANCELLED
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {str(e)}")
+            job.error = str(e)
+            job.status = FAILED
+        job.finished = time.time()
+        metrics.increment("jobs_finished_total", kind=job.kind, status=job.status)
+
+    def get(self, job_id):
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+        if job is not None:
+            job.last_seen = time.time()
+        return job
+
+    def cancel(self, job_id, reason="cancelled"):
+        # Stops the job's in-flight LLM requests; a queued job finishes as soon as it reaches a worker
+        job = self.get(job_id)
+        if job is not None and not job.is_finished:
+            job.token.cancel(reason)
+            logger.info(f"Cancelling job {job_id} ({job.kind}): {reason}")
+
+    def position(self, job_id):
+        # Jobs submitted earlier that are still waiting for a worker
+        with self._lock:
+            waiting = [other_id for other_id, job in self._jobs.items() if job.status == QUEUED]
+        return waiting.index(job_id) if job_id in waiting else 0
+
+    def _reap(self):
+        while True:
+            time.sleep(max(self.abandon_after / 4, 1))
+            cutoff = time.time() - self.abandon_after
+            with self._lock:
+                abandoned = [job for job in self._jobs.values() if not job.is_finished and job.last_seen < cutoff]
+            for job in abandoned:
+                if not job.token.cancel_requested:
+                    job.token.cancel("abandoned")
+                    logger.info(f"Cancelling job {job.id} ({job.kind}): not viewed for {self.abandon_after}s")
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished is not None and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+
+def get_job_queue():
+    # One queue per process, shared by every session (and by tests driving the app in-process)
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue()
+    return _job_queue
@@ -0,0 +1,254 @@
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from keyword_index import NO_KEYWORDS, open_keyword_index
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ['Filename', 'Checked', 'Keywords']
+STATE_FILE = "documents.json"
+COUNTS_FILE = "counts.npz"
+TOP_N = 250  # Keywords kept per bulletin
+COUNT_CHUNKSIZE = 8  # Files per worker task
+
+CHECKBOX = re.compile(r'\((X|\?|☐)\)\s*(\w+)')
+CLEAN_PATTERNS = [
+    re.compile(r'\((X|\?|☐)\)\s*\w+'),  # Checkboxes
+    re.compile(r'[\|\-\_]{2,}'),  # Repeated '|', '-', '_'
+]
+TOKEN = re.compile(r'(?u)\b\w\w+\b')  # TfidfVectorizer's default token pattern
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def clean_text(text):
+    for pattern in CLEAN_PATTERNS:
+        text = pattern.sub('', text)
+    return text.strip()
+
+
+def count_terms(path):
+    """Return the checked labels and the term counts of one bulletin text file."""
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        text = f.read()
+    checked = ', '.join(label for state, label in CHECKBOX.findall(text) if state == 'X')
+    terms = Counter(term for term in TOKEN.findall(clean_text(text).lower()) if term not in ENGLISH_STOP_WORDS)
+    return checked, dict(terms)
+
+
+def top_keywords(counts, vocabulary, top_n=TOP_N):
+    """Return the top_n terms of each row of a document-term count matrix, ranked by corpus TF-IDF.
+
+    Ties are broken alphabetically, as the per-document notebook pipeline did.
+    """
+    from sklearn.feature_extraction.text import TfidfTransformer
+
+    scores = TfidfTransformer().fit_transform(counts).tocsr()
+    scores.sort_indices()
+    rows = np.repeat(np.arange(scores.shape[0]), np.diff(scores.indptr))
+    term_rank = np.argsort(np.argsort(np.asarray(vocabulary, dtype=object)))
+    # One sort over every nonzero: by row, then score descending, then term
+    order = np.lexsort((term_rank[scores.indices], -scores.data, rows))
+    position = np.arange(len(order)) - scores.indptr[rows[order]]
+    keep = order[position < top_n]
+
+    keywords = [[] for _ in range(scores.shape[0])]
+    for row, column in zip(rows[keep], scores.indices[keep]):
+        keywords[row].append(vocabulary[column])
+    return [', '.join(terms) if terms else NO_KEYWORDS for terms in keywords]
+
+
+class KeywordCorpus:
+    """Per-bulletin term counts behind keyword_extraction.csv, kept between runs.
+
+    Each bulletin's file hash, checked labels and term counts are stored in
+    state_dir, so an update only re-reads new or changed files. Keywords are
+    ranked by TF-IDF over the whole corpus, computed from the stored counts.
+    """
+
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        self.documents = []  # [{"name", "sha256", "checked"}], one per row of counts
+        self.vocabulary = []
+        self.counts = None
+        state_path = os.path.join(state_dir, STATE_FILE)
+        if os.path.exists(state_path):
+            from scipy import sparse
+
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.documents = state['documents']
+            self.vocabulary = state['vocabulary']
+            self.counts = sparse.load_npz(os.path.join(state_dir, COUNTS_FILE)).tocsr()
+
+    def update(self, paths, workers=None):
+        """Bring the stored counts in line with paths and return the names that were added, changed and removed."""
+        from scipy import sparse
+
+        known = {document['name']: row for row, document in enumerate(self.documents)}
+        current = {os.path.basename(path): path for path in paths}
+        hashes = {name: file_sha256(path) for name, path in current.items()}
+        pending = [name for name in sorted(current)
+                   if name not in known or self.documents[known[name]]['sha256'] != hashes[name]]
+        removed = [name for name in known if name not in current]
+
+        pending_paths = [current[name] for name in pending]
+        if workers == 1 or len(pending) <= 1:
+            counted = [count_terms(path) for path in pending_paths]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                counted = list(pool.map(count_terms, pending_paths, chunksize=COUNT_CHUNKSIZE))
+
+        columns = {term: column for column, term in enumerate(self.vocabulary)}
+        for _, terms in counted:
+            for term in terms:
+                columns.setdefault(term, len(columns))
+        self.vocabulary = list(columns)
+
+        # Unchanged rows keep their stored counts; new and changed bulletins are appended
+        kept = [row for row, document in enumerate(self.documents)
+                if document['name'] in current and document['name'] not in pending]
+        blocks = []
+        if kept:
+            old = self.counts[kept]
+            blocks.append(sparse.csr_matrix((old.data, old.indices, old.indptr), shape=(len(kept), len(columns))))
+        if counted:
+            data, indices, indptr = [], [], [0]
+            for _, terms in counted:
+                indices.extend(columns[term] for term in terms)
+                data.extend(terms.values())
+                indptr.append(len(indices))
+            blocks.append(sparse.csr_matrix((np.array(data, dtype=np.int64), np.array(indices, dtype=np.int64), indptr),
+                                            shape=(len(counted), len(columns))))
+        self.documents = [self.documents[row] for row in kept] + [
+            {"name": name, "sha256": hashes[name], "checked": checked} for name, (checked, _) in zip(pending, counted)]
+        self.counts = sparse.vstack(blocks, format='csr') if blocks else sparse.csr_matrix((0, len(columns)), dtype=np.int64)
+        self._drop_unused_terms()
+
+        added = [name for name in pending if name not in known]
+        changed = [name for name in pending if name in known]
+        return added, changed, removed
+
+    def _drop_unused_terms(self):
+        # Terms only found in removed or changed versions of bulletins
+        used = np.flatnonzero(self.counts.getnnz(axis=0))
+        if len(used) < len(self.vocabulary):
+            self.counts = self.counts[:, used]
+            self.vocabulary = [self.vocabulary[column] for column in used]
+
+    def keywords(self, top_n=TOP_N):
+        """Return {filename: (checked labels, keywords)} for every stored bulletin."""
+        if not self.documents:
+            return {}
+        ranked = top_keywords(self.counts, self.vocabulary, top_n)
+        return {document['name']: (document['checked'], keywords) for document, keywords in zip(self.documents, ranked)}
+
+    def save(self):
+        from scipy import sparse
+
+        os.makedirs(self.state_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.state_dir, suffix='.npz')
+        os.close(fd)
+        sparse.save_npz(tmp_path, self.counts)
+        os.replace(tmp_path, os.path.join(self.state_dir, COUNTS_FILE))
+        write_atomic(os.path.join(self.state_dir, STATE_FILE),
+                     lambda f: json.dump({"documents": self.documents, "vocabulary": self.vocabulary}, f))
+
+
+def write_atomic(path, write):
+    # Write to a temp file and rename so readers (the app reloads the CSV on change) never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            write(f)
+        # mkstemp creates the file owner-only; keep the permissions of the file being replaced
+        os.chmod(tmp_path, os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_keyword_csv(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def update_keyword_corpus(corpus_dir, output_csv, state_dir, pattern='*.txt', workers=None, top_n=TOP_N):
+    """Update output_csv from the bulletin text files in corpus_dir, re-reading only new or changed files.
+
+    Existing rows keep their order and new bulletins are appended. Rows for
+    bulletins removed from corpus_dir are dropped; rows never produced from
+    it are left untouched. The keyword store next to output_csv is rebuilt.
+    Returns the number of rows whose keywords changed.
+    """
+    paths = sorted(glob.glob(os.path.join(corpus_dir, pattern)))
+    corpus = KeywordCorpus(state_dir)
+    added, changed, removed = corpus.update(paths, workers)
+    keywords = corpus.keywords(top_n)
+
+    rows = []
+    updated = 0
+    removed = set(removed)
+    for row in read_keyword_csv(output_csv):
+        name = row['Filename']
+        if name in removed:
+            continue
+        if name in keywords:
+            checked, terms = keywords.pop(name)
+            if (row['Checked'], row['Keywords']) != (checked, terms):
+                updated += 1
+            row = {"Filename": name, "Checked": checked, "Keywords": terms}
+        rows.append(row)
+    for name, (checked, terms) in keywords.items():
+        rows.append({"Filename": name, "Checked": checked, "Keywords": terms})
+        updated += 1
+
+    def write(f):
+        writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+    write_atomic(output_csv, write)
+    # Rebuild the memory-mapped keyword store the app and batch runs load
+    open_keyword_index(output_csv)
+    corpus.save()
+    logger.info(f"Keyword corpus has {len(corpus.documents)} bulletins: {len(added)} added, {len(changed)} changed, "
+                f"{len(removed)} removed, {updated} rows updated")
+    return updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or update keyword_extraction.csv from bulletin text files.")
+    parser.add_argument("corpus_dir", help="Directory containing the bulletin text files")
+    parser.add_argument("--output", default="keyword_extraction.csv")
+    parser.add_argument("--state-dir", default=os.environ.get("KEYWORD_CORPUS_DIR", ".cache/keyword_corpus"))
+    parser.add_argument("--pattern", default="*.txt")
+    parser.add_argument("--workers", type=int, default=None, help="Processes reading files (default: CPU count)")
+    parser.add_argument("--top-n", type=int, default=TOP_N)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    update_keyword_corpus(args.corpus_dir, args.output, args.state_dir, args.pattern, args.workers, args.top_n)
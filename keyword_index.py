@@ -0,0 +1,347 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+
+import numpy as np
+from rapidfuzz import fuzz, process, utils
+
+logger = logging.getLogger(__name__)
+
+REGION_SPECIFIC_TERMS = ['USA', 'EU', 'China', 'Japan', 'Korea', 'Canada', 'Australia', 'UK', 'Germany', 'France', 'Italy', 'Spain']
+REGION_SPECIFIC = re.compile('|'.join(re.escape(term) for term in REGION_SPECIFIC_TERMS), re.IGNORECASE)
+MATCH_THRESHOLD = 75  # Best match must score above this (0-100)
+MAX_CANDIDATES = 256  # Rows that get a full fuzzy score per query
+STORE_SUFFIX = '.arrow'
+EMBEDDINGS_SUFFIX = '.embeddings.arrow'
+NO_KEYWORDS = "No keywords could be extracted."  # Keywords of a bulletin with no usable text
+SUGGEST_TOP_K = 5  # Nearest corpus rows whose keywords are merged
+SUGGEST_MIN_SIMILARITY = 0.3  # Rows less similar than this (cosine) contribute nothing
+MAX_SUGGESTED_KEYWORDS = 250  # As many as one row of keyword_extraction.csv
+
+
+def is_region_specific(keyword):
+    return REGION_SPECIFIC.search(keyword) is not None
+
+
+def _split_keywords(keywords, region_specific):
+    # Comma-separated keywords without region-specific ones; region_specific memoizes the check per keyword,
+    # since vocabulary repeats heavily across rows
+    kept = []
+    for keyword in keywords.split(','):
+        keyword = keyword.strip()
+        if keyword not in region_specific:
+            region_specific[keyword] = is_region_specific(keyword)
+        if not region_specific[keyword]:
+            kept.append(keyword)
+    return kept
+
+
+def _interned_lists(offsets, ids, terms):
+    # list<dictionary<int32, string>>: each distinct term is stored once and rows hold term ids
+    import pyarrow as pa
+    values = pa.DictionaryArray.from_arrays(pa.array(ids, pa.int32()), pa.array(list(terms), pa.string()))
+    return pa.ListArray.from_arrays(pa.array(offsets, pa.int32()), values)
+
+
+def build_keyword_table(choices, keywords):
+    """Return the keyword store for parallel lists of Checked labels and comma-separated keywords.
+
+    Choices are normalized and deduplicated, keeping the first row as a full
+    scan would. Keywords are split, region-specific ones dropped, and stored
+    with the choice tokens as interned term ids.
+    """
+    import pyarrow as pa
+
+    first_rows = {}
+    for row, choice in enumerate(choices):
+        first_rows.setdefault(utils.default_process(choice), row)
+
+    terms = {}
+    region_specific = {}
+    keyword_offsets = [0]
+    keyword_ids = []
+    for row in first_rows.values():
+        keyword_ids.extend(terms.setdefault(keyword, len(terms)) for keyword in _split_keywords(keywords[row], region_specific))
+        keyword_offsets.append(len(keyword_ids))
+
+    tokens = {}
+    token_offsets = [0]
+    token_ids = []
+    for choice in first_rows:
+        token_ids.extend(tokens.setdefault(token, len(tokens)) for token in dict.fromkeys(choice.split()))
+        token_offsets.append(len(token_ids))
+
+    return pa.table({
+        'choice': pa.array(list(first_rows), pa.string()),
+        'keywords': _interned_lists(keyword_offsets, keyword_ids, terms),
+        'tokens': _interned_lists(token_offsets, token_ids, tokens),
+    })
+
+
+def _single_chunk(column):
+    return column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+
+
+def _save_table(table, path):
+    import pyarrow as pa
+
+    # Write to a temp file and rename so readers never see a partial store
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f, pa.ipc.new_file(f, table.schema) as writer:
+            writer.write_table(table)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _load_table(path):
+    import pyarrow as pa
+    # The table's buffers point into the mapping, which stays open as long as they are referenced
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def _list_parts(column):
+    # Offsets (from 0), term ids and the term dictionary of a single-chunk list<dictionary> column
+    array = _single_chunk(column)
+    offsets = array.offsets.to_numpy()
+    values = array.flatten()
+    return offsets - offsets[0], values.indices.to_numpy(), values.dictionary
+
+
+class KeywordIndex:
+    """Fuzzy lookup from a constructed prompt to the keywords of the closest past bulletin.
+
+    Backed by the Arrow table from build_keyword_table, which save() writes
+    uncompressed so load() can memory-map it: worker processes share the
+    pages, and nothing proportional to the keyword text is parsed at load.
+    An inverted index from choice tokens to rows narrows each query to at
+    most MAX_CANDIDATES rows sharing tokens with the prompt, which are then
+    scored with rapidfuzz's WRatio (the fuzzywuzzy extractOne default).
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.choices = _single_chunk(table.column('choice'))
+        self.keyword_offsets, self.keyword_ids, self.terms = _list_parts(table.column('keywords'))
+
+        token_offsets, token_ids, tokens = _list_parts(table.column('tokens'))
+        self.token_ids = {token: i for i, token in enumerate(tokens.to_pylist())}
+        token_counts = np.diff(token_offsets)
+        rows = np.repeat(np.arange(len(token_counts)), token_counts)
+        # Postings as one array grouped by token; a stable sort keeps each token's rows in order
+        self.posting_rows = rows[np.argsort(token_ids, kind='stable')]
+        self.posting_offsets = np.concatenate([[0], np.cumsum(np.bincount(token_ids, minlength=len(self.token_ids)))])
+        self.token_counts = np.maximum(token_counts, 1)
+
+    @classmethod
+    def from_dataframe(cls, keywords_df):
+        checked = keywords_df[keywords_df['Checked'].notna()]
+        return cls(build_keyword_table(checked['Checked'].astype(str).tolist(), checked['Keywords'].fillna('').astype(str).tolist()))
+
+    @classmethod
+    def from_csv(cls, path):
+        import pandas as pd
+        return cls.from_dataframe(pd.read_csv(path))
+
+    @classmethod
+    def load(cls, path):
+        return cls(_load_table(path))
+
+    def save(self, path):
+        _save_table(self.table, path)
+
+    def __len__(self):
+        return len(self.choices)
+
+    def keywords(self, row):
+        ids = self.keyword_ids[self.keyword_offsets[row]:self.keyword_offsets[row + 1]]
+        return ', '.join(self.terms.take(ids).to_pylist())
+
+    def candidates(self, query):
+        if len(self.choices) <= MAX_CANDIDATES:
+            return np.arange(len(self.choices))
+        rows = [self.posting_rows[self.posting_offsets[i]:self.posting_offsets[i + 1]]
+                for i in {self.token_ids[token] for token in query.split() if token in self.token_ids}]
+        if not rows:
+            return np.empty(0, dtype=np.int64)
+        overlap = np.bincount(np.concatenate(rows), minlength=len(self.choices))
+        matched = np.flatnonzero(overlap)
+        if len(matched) > MAX_CANDIDATES:
+            # Against a long prompt WRatio saturates: any row sharing a token scores the same, so a full
+            # scan returns the earliest such row. Keep the earliest overlapping rows for that tie, and the
+            # rows best covered by the prompt, which are the only ones that can score above it.
+            earliest = matched[:MAX_CANDIDATES // 2]
+            rest = matched[MAX_CANDIDATES // 2:]
+            coverage = overlap[rest] / self.token_counts[rest]
+            covered = rest[np.lexsort((rest, -coverage))[:MAX_CANDIDATES - len(earliest)]]
+            matched = np.concatenate([earliest, covered])
+        # Score in row order so ties resolve to the earliest row, as a full scan would
+        return np.sort(matched)
+
+    def match(self, prompt, threshold=MATCH_THRESHOLD):
+        """Return the filtered keywords of the best-matching row, or "" if nothing scores above threshold."""
+        query = utils.default_process(prompt)
+        rows = self.candidates(query)
+        if len(rows) == 0:
+            return ""
+        best = process.extractOne(query, self.choices.take(rows).to_pylist(), scorer=fuzz.WRatio, processor=None, score_cutoff=threshold)
+        # fuzzywuzzy compared rounded integer scores against the threshold
+        if best is None or round(best[1]) <= threshold:
+            return ""
+        return self.keywords(rows[best[2]])
+
+
+def open_keyword_index(csv_path, store_path=None):
+    """Memory-map the keyword store next to csv_path, rebuilding it first if it is missing or older than the CSV."""
+    store_path = store_path or os.path.splitext(csv_path)[0] + STORE_SUFFIX
+    if not os.path.exists(store_path) or os.path.getmtime(store_path) < os.path.getmtime(csv_path):
+        index = KeywordIndex.from_csv(csv_path)
+        try:
+            index.save(store_path)
+        except OSError as e:
+            logger.warning(f"Could not write keyword store {store_path}, using the CSV in memory: {str(e)}")
+            return index
+    return KeywordIndex.load(store_path)
+
+
+def embedding_text(filename, checked, keywords):
+    # Text embedded for one corpus row: readable file name, checked tags, then keywords in rank order
+    # (the model truncates long inputs, so the highest-ranked keywords are the ones that count)
+    title = os.path.splitext(filename)[0].replace('_', ' ')
+    return f"{title}. Tags: {checked}. Keywords: {keywords}"
+
+
+class KeywordEmbeddings:
+    """One normalized embedding per row of the keyword corpus, for suggesting keywords from a document.
+
+    The table holds each row's file name, the sha256 of the text that was
+    embedded (so a rebuild only encodes changed rows), its region-filtered
+    keywords as interned term ids, and the embedding. Like KeywordIndex it is
+    saved as an uncompressed Arrow file and memory-mapped; embeddings is a
+    zero-copy (rows, dimension) float32 view of it.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.model_name = (table.schema.metadata or {}).get(b'model', b'').decode('utf-8')
+        self.keys = _single_chunk(table.column('key'))
+        self.keyword_offsets, self.keyword_ids, self.terms = _list_parts(table.column('keywords'))
+        embeddings = _single_chunk(table.column('embedding'))
+        self.embeddings = embeddings.flatten().to_numpy().reshape(len(embeddings), embeddings.type.list_size)
+
+    @classmethod
+    def build(cls, keywords_df, embeddings_model, model_name, previous=None, batch_size=64):
+        """Embed every row of a keyword DataFrame, reusing rows of previous whose text is unchanged."""
+        import pyarrow as pa
+
+        rows = keywords_df[keywords_df['Keywords'].notna() & (keywords_df['Keywords'] != NO_KEYWORDS)]
+        filenames = rows['Filename'].astype(str).tolist()
+        keywords = rows['Keywords'].astype(str).tolist()
+        texts = [embedding_text(filename, checked, row_keywords) for filename, checked, row_keywords
+                 in zip(filenames, rows['Checked'].fillna('').astype(str), keywords)]
+        keys = [hashlib.sha256(text.encode('utf-8')).hexdigest() for text in texts]
+
+        dimension = embeddings_model.get_sentence_embedding_dimension()
+        embeddings = np.zeros((len(texts), dimension), dtype=np.float32)
+        reusable = {}
+        if previous is not None and previous.model_name == model_name:
+            reusable = {key: row for row, key in enumerate(previous.keys.to_pylist())}
+        missing = [row for row, key in enumerate(keys) if key not in reusable]
+        for row, key in enumerate(keys):
+            if key in reusable:
+                embeddings[row] = previous.embeddings[reusable[key]]
+        if missing:
+            embeddings[missing] = embeddings_model.encode([texts[row] for row in missing], batch_size=batch_size,
+                                                          convert_to_numpy=True, normalize_embeddings=True)
+        logger.info(f"Embedded {len(missing)} of {len(texts)} keyword rows")
+
+        terms = {}
+        region_specific = {}
+        keyword_offsets = [0]
+        keyword_ids = []
+        for row_keywords in keywords:
+            keyword_ids.extend(terms.setdefault(keyword, len(terms)) for keyword in _split_keywords(row_keywords, region_specific))
+            keyword_offsets.append(len(keyword_ids))
+
+        table = pa.table({
+            'filename': pa.array(filenames, pa.string()),
+            'key': pa.array(keys, pa.string()),
+            'keywords': _interned_lists(keyword_offsets, keyword_ids, terms),
+            'embedding': pa.FixedSizeListArray.from_arrays(pa.array(embeddings.ravel(), pa.float32()), dimension),
+        })
+        return cls(table.replace_schema_metadata({'model': model_name}))
+
+    @classmethod
+    def load(cls, path):
+        return cls(_load_table(path))
+
+    def save(self, path):
+        _save_table(self.table, path)
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def suggest(self, document_embedding, top_k=SUGGEST_TOP_K, limit=MAX_SUGGESTED_KEYWORDS):
+        """Return up to limit keywords from the rows nearest a normalized document embedding, or "".
+
+        Each keyword is weighted by the summed similarity of the rows it
+        appears in; ties keep the order of the closest row's ranking.
+        """
+        if len(self.embeddings) == 0:
+            return ""
+        scores = self.embeddings @ np.asarray(document_embedding, dtype=np.float32)
+        top_k = min(top_k, len(scores))
+        nearest = np.argpartition(-scores, top_k - 1)[:top_k]
+        nearest = nearest[np.argsort(-scores[nearest], kind='stable')]
+        nearest = nearest[scores[nearest] >= SUGGEST_MIN_SIMILARITY]
+        if len(nearest) == 0:
+            return ""
+
+        ids = [self.keyword_ids[self.keyword_offsets[row]:self.keyword_offsets[row + 1]] for row in nearest]
+        weights = np.repeat(scores[nearest], [len(row_ids) for row_ids in ids])
+        unique_ids, first_seen, inverse = np.unique(np.concatenate(ids), return_index=True, return_inverse=True)
+        totals = np.bincount(inverse, weights=weights)
+        order = np.lexsort((first_seen, -totals))[:limit]
+        return ', '.join(self.terms.take(unique_ids[order]).to_pylist())
+
+
+def open_keyword_embeddings(csv_path, embeddings_model, model_name, path=None):
+    """Memory-map the keyword embeddings next to csv_path, updating them first if older than the CSV or from another model."""
+    path = path or os.path.splitext(csv_path)[0] + EMBEDDINGS_SUFFIX
+    previous = KeywordEmbeddings.load(path) if os.path.exists(path) else None
+    if previous is not None and previous.model_name == model_name and os.path.getmtime(path) >= os.path.getmtime(csv_path):
+        return previous
+
+    import pandas as pd
+    embeddings = KeywordEmbeddings.build(pd.read_csv(csv_path), embeddings_model, model_name, previous)
+    try:
+        embeddings.save(path)
+    except OSError as e:
+        logger.warning(f"Could not write keyword embeddings {path}, using them in memory: {str(e)}")
+        return embeddings
+    return KeywordEmbeddings.load(path)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the memory-mapped keyword store from a keyword CSV.")
+    parser.add_argument("csv", nargs="?", default="keyword_extraction.csv")
+    parser.add_argument("--output", help="Store path (default: the CSV path with an .arrow suffix)")
+    parser.add_argument("--embeddings-model", help="Also update the keyword embeddings with this sentence-transformers model")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    index = KeywordIndex.from_csv(args.csv)
+    index.save(args.output or os.path.splitext(args.csv)[0] + STORE_SUFFIX)
+    print(f"Wrote {len(index)} rows")
+    if args.embeddings_model:
+        from sentence_transformers import SentenceTransformer
+        embeddings = open_keyword_embeddings(args.csv, SentenceTransformer(args.embeddings_model), args.embeddings_model)
+        print(f"Keyword embeddings cover {len(embeddings)} rows")
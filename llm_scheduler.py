@@ -0,0 +1,275 @@
+import contextvars
+import logging
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from cancellation import cancel_scope, check_cancelled
+from metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: limits stay per process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0  # Chat answers: dispatched before any bulk request
+BULK = 1  # Summaries and batch runs
+
+POLL_SECONDS = 0.1  # How often a waiting request re-checks on its own: for cancellation, refilled tokens and slots freed by other processes
+BUDGET_FORMAT = 'dd'  # Shared token bucket file: tokens left, time of last update
+
+_request = contextvars.ContextVar("llm_request", default=("default", BULK))
+_attempt = contextvars.ContextVar("llm_attempt", default=(0, None, None))  # cost, timeout and admission callback
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+@contextmanager
+def request_context(user, priority=BULK):
+    """Attribute the LLM calls made inside the block (including from map_ordered) to user at priority."""
+    token = _request.set((user, priority))
+    try:
+        yield
+    finally:
+        _request.reset(token)
+
+
+@contextmanager
+def attempt_context(cost=0, timeout=None, on_admitted=None):
+    """Set the estimated cost and timeout of the LLM request made inside the block, once admitted."""
+    token = _attempt.set((cost, timeout, on_admitted))
+    try:
+        yield
+    finally:
+        _attempt.reset(token)
+
+
+@contextmanager
+def admitted():
+    """Hold a scheduler slot for the LLM request sent inside the block.
+
+    Entered by the transport only for requests that actually go to the
+    endpoint, so cache hits never queue or use the token budget. The
+    attempt's timeout (see attempt_context) starts once the slot is granted.
+    """
+    cost, timeout, on_admitted = _attempt.get()
+    with get_scheduler().slot(cost):
+        if on_admitted is not None:
+            on_admitted()
+        with cancel_scope(timeout):
+            yield
+
+
+class SharedLimits:
+    """In-flight slots and a token bucket shared by every process using the same directory.
+
+    Each slot is a lock file held with flock while a request is in flight, so
+    a crashed process releases its slots. The first `reserved` slots are
+    only handed to interactive requests.
+    """
+
+    def __init__(self, directory, max_in_flight, tokens_per_minute, reserved):
+        os.makedirs(directory, exist_ok=True)
+        # Opened once per process; a slot is taken and given back with flock alone
+        self.slot_files = [open(os.path.join(directory, f"slot-{i}.lock"), 'a+b') for i in range(max_in_flight)]
+        self.budget_file = open(os.path.join(directory, "budget"), 'a+b')
+        self.tokens_per_minute = tokens_per_minute
+        self.reserved = reserved
+        self._held = set()  # Slots held by this process; flock would grant them again to the same file
+
+    def acquire(self, priority):
+        # Returns the index of the slot taken, or None if every slot this priority may use is taken
+        start = 0 if priority == INTERACTIVE else self.reserved
+        for i in range(start, len(self.slot_files)):
+            if i in self._held:
+                continue
+            try:
+                fcntl.flock(self.slot_files[i], fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            self._held.add(i)
+            return i
+        return None
+
+    def release(self, slot):
+        if slot is not None:
+            fcntl.flock(self.slot_files[slot], fcntl.LOCK_UN)
+            self._held.discard(slot)
+
+    def take(self, cost):
+        # Debit cost from the shared bucket if it has enough (or is full), under an exclusive lock
+        if not self.tokens_per_minute:
+            return True
+        f = self.budget_file
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            data = f.read(struct.calcsize(BUDGET_FORMAT))
+            now = time.time()
+            tokens, updated = struct.unpack(BUDGET_FORMAT, data) if len(data) == struct.calcsize(BUDGET_FORMAT) else (self.tokens_per_minute, now)
+            tokens = min(self.tokens_per_minute, tokens + (now - updated) * self.tokens_per_minute / 60)
+            taken = cost <= tokens or tokens >= self.tokens_per_minute
+            if taken:
+                tokens -= cost
+            f.seek(0)
+            f.truncate()
+            f.write(struct.pack(BUDGET_FORMAT, tokens, now))
+            f.flush()
+            return taken
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class Waiter:
+    __slots__ = ('cost', 'priority', 'queued', 'granted', 'slot', 'event')
+
+    def __init__(self, cost, priority):
+        self.cost = cost
+        self.priority = priority
+        self.queued = time.perf_counter()
+        self.granted = False
+        self.slot = None
+        self.event = threading.Event()  # Set when granted
+
+
+class Scheduler:
+    """Admission control in front of every LLM request in the process.
+
+    Waiting requests are served interactive before bulk, and round-robin
+    across users within a priority, so one large upload cannot starve other
+    sessions. At most max_in_flight requests run at once, `reserved` of
+    those slots only for interactive requests, and tokens_per_minute (if
+    set) budgets the estimated tokens of the requests started per minute.
+    With shared_dir the slot and token limits apply across processes.
+    """
+
+    def __init__(self, max_in_flight=0, tokens_per_minute=0, reserved=0, shared_dir=None):
+        self.max_in_flight = max_in_flight
+        self.tokens_per_minute = tokens_per_minute
+        self.reserved = min(reserved, max(max_in_flight - 1, 0))
+        self.shared = None
+        if shared_dir and max_in_flight and fcntl is not None:
+            self.shared = SharedLimits(shared_dir, max_in_flight, tokens_per_minute, self.reserved)
+        elif shared_dir:
+            logger.warning("LLM_SCHEDULER_DIR needs LLM_MAX_IN_FLIGHT and flock support; limits apply per process")
+        self._lock = threading.Lock()
+        self._queues = {INTERACTIVE: OrderedDict(), BULK: OrderedDict()}  # priority -> user -> waiters, in turn order
+        self._in_flight = 0
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+
+    @classmethod
+    def from_env(cls):
+        max_in_flight = int(os.environ.get("LLM_MAX_IN_FLIGHT", "16"))
+        return cls(
+            max_in_flight=max_in_flight,
+            tokens_per_minute=int(os.environ.get("LLM_TOKENS_PER_MINUTE", "0")),
+            reserved=int(os.environ.get("LLM_INTERACTIVE_RESERVED", "2")),
+            shared_dir=os.environ.get("LLM_SCHEDULER_DIR") or None,
+        )
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.tokens_per_minute, self._tokens + (now - self._updated) * self.tokens_per_minute / 60)
+        self._updated = now
+
+    def _has_budget(self, cost):
+        if not self.tokens_per_minute:
+            return True
+        self._refill()
+        # A request larger than the whole bucket goes once the bucket is full, so it cannot wait forever
+        return cost <= self._tokens or self._tokens >= self.tokens_per_minute
+
+    def _dispatch(self):
+        # Grant slots to waiting requests in turn order until a limit is reached; called with the lock held
+        for priority, users in self._queues.items():
+            while users:
+                user, waiters = next(iter(users.items()))
+                waiter = waiters[0]
+                if self.shared is not None:
+                    waiter.slot = self.shared.acquire(priority)
+                    if waiter.slot is None:
+                        break
+                    if not self.shared.take(waiter.cost):
+                        self.shared.release(waiter.slot)
+                        waiter.slot = None
+                        return
+                else:
+                    limit = self.max_in_flight - (self.reserved if priority == BULK else 0)
+                    if self.max_in_flight and self._in_flight >= limit:
+                        break
+                    if not self._has_budget(waiter.cost):
+                        # Later requests wait too, so the head of the queue is not overtaken indefinitely
+                        return
+                    self._tokens -= waiter.cost if self.tokens_per_minute else 0
+                waiters.popleft()
+                # The user goes to the back of the line for its next request
+                del users[user]
+                if waiters:
+                    users[user] = waiters
+                self._in_flight += 1
+                waiter.granted = True
+                waiter.event.set()
+                metrics.observe("llm_queue_seconds", time.perf_counter() - waiter.queued, priority=priority)
+
+    def _release(self, waiter):
+        with self._lock:
+            self._in_flight -= 1
+            if self.shared is not None:
+                self.shared.release(waiter.slot)
+            self._dispatch()
+
+    def _withdraw(self, user, waiter):
+        with self._lock:
+            waiters = self._queues[waiter.priority].get(user)
+            if waiters is not None and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._queues[waiter.priority][user]
+
+    @contextmanager
+    def slot(self, cost=0):
+        """Wait for this request's turn, then hold an in-flight slot for the block."""
+        user, priority = _request.get()
+        waiter = Waiter(cost, priority)
+        with self._lock:
+            self._queues[priority].setdefault(user, deque()).append(waiter)
+            self._dispatch()
+        try:
+            # Woken as soon as a local release grants the slot; the timeout only catches cancellation,
+            # refilled tokens and capacity freed by other processes
+            while not waiter.granted:
+                check_cancelled()
+                if not waiter.event.wait(POLL_SECONDS):
+                    with self._lock:
+                        self._dispatch()
+        except BaseException:
+            self._withdraw(user, waiter)
+            if waiter.granted:
+                self._release(waiter)
+            raise
+        try:
+            yield
+        finally:
+            self._release(waiter)
+
+
+def get_scheduler():
+    # Created on first use, so LLM_* settings made before the first request (e.g. by batch_summarize) apply
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = Scheduler.from_env()
+    return _scheduler
+
+
+def set_scheduler(scheduler):
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
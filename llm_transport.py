@@ -0,0 +1,205 @@
+import logging
+import os
+import socket
+import threading
+import time
+
+import httpx
+import orjson
+
+from cancellation import check_cancelled, current_token, time_left
+from llm_scheduler import admitted
+from metrics import metrics
+from response_cache import ResponseCache, fingerprint
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_BASE_URL = "https://opensource-challenger-api.prdlvgpu1.aiaccel.dell.com/v1"
+MAX_CONNECTIONS = 16
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = 120.0
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_client = None
+_client_lock = threading.Lock()
+_response_cache = None
+
+
+def get_client():
+    # One pooled keep-alive client per process, shared by every chunk and session
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                max_connections = int(os.environ.get("LLM_MAX_CONNECTIONS", MAX_CONNECTIONS))
+                _client = httpx.Client(
+                    base_url=os.environ.get("LLM_BASE_URL", DEFAULT_API_BASE_URL),
+                    headers={
+                        'accept': 'application/json',
+                        'api-key': os.environ["CHALLENGER_GENAI_API_KEY"],
+                        'Content-Type': 'application/json',
+                    },
+                    limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+                    timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                    http2=HTTP2_AVAILABLE,
+                    verify=False,
+                )
+    return _client
+
+
+def get_response_cache():
+    global _response_cache
+    if _response_cache is None:
+        with _client_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    os.environ.get("LLM_CACHE_PATH", ".cache/responses.sqlite3"),
+                    ttl_seconds=float(os.environ.get("LLM_CACHE_TTL_HOURS", "168")) * 3600,
+                    max_bytes=int(os.environ.get("LLM_CACHE_MAX_MB", "256")) * 1024 * 1024,
+                    enabled=os.environ.get("LLM_CACHE_ENABLED", "1") != "0",
+                )
+    return _response_cache
+
+
+class SSEDecoder:
+    """Incremental decoder for OpenAI-style chat completion event streams.
+
+    Feed raw bytes as they arrive; complete `data:` events are parsed with
+    orjson and their delta content is returned.
+    """
+
+    def __init__(self):
+        self.buffer = b""
+        self.done = False
+
+    def feed(self, data):
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b"\n")
+        return self._decode_lines(lines)
+
+    def flush(self):
+        lines, self.buffer = [self.buffer], b""
+        return self._decode_lines(lines)
+
+    def _decode_lines(self, lines):
+        pieces = []
+        for line in lines:
+            if self.done:
+                break
+            if not line.startswith(b"data:"):
+                continue
+            payload = line[5:].strip()
+            if payload == b"[DONE]":
+                self.done = True
+                break
+            if not payload:
+                continue
+            try:
+                event = orjson.loads(payload)
+            except orjson.JSONDecodeError:
+                logger.warning("Skipping malformed stream event")
+                continue
+            choices = event.get('choices')
+            if choices:
+                content = choices[0].get('delta', {}).get('content')
+                if content:
+                    pieces.append(content)
+        return pieces
+
+
+def abort_stream(response):
+    # close() does not wake a read blocked in another thread, but shutting the socket down does. An HTTP/2
+    # connection carries other requests too, so it is left alone and the read timeout applies
+    if response.http_version == "HTTP/2":
+        return
+    stream = response.extensions.get("network_stream")
+    sock = stream.get_extra_info("socket") if stream is not None else None
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def iter_chat_deltas(payload, decoder=None):
+    """POST a streaming chat completion and yield content deltas as they arrive.
+
+    Raises Cancelled once the current cancel_scope is cancelled or past its
+    deadline: cancellation shuts the connection down, waking a read that
+    is waiting for the next chunk, so the endpoint stops generating and the
+    scheduler slot is freed at once. No single read waits past the deadline.
+    Pass a decoder to find out afterwards whether the stream was complete
+    (decoder.done), i.e. ended with [DONE] rather than a dropped connection.
+    """
+    decoder = decoder if decoder is not None else SSEDecoder()
+    check_cancelled()
+    token = current_token()
+    timeout = httpx.Timeout(time_left(READ_TIMEOUT), connect=time_left(CONNECT_TIMEOUT))
+    with get_client().stream("POST", "/chat/completions", content=orjson.dumps({**payload, "stream": True}), timeout=timeout) as response:
+        unregister = token.on_cancel(lambda: abort_stream(response)) if token is not None else None
+        try:
+            response.raise_for_status()
+            for data in response.iter_bytes():
+                check_cancelled()
+                yield from decoder.feed(data)
+                if decoder.done:
+                    return
+            yield from decoder.flush()
+        except httpx.TransportError:
+            # A stream shut down by cancellation, or a read cut short by the deadline, is not a retryable error
+            check_cancelled()
+            raise
+        finally:
+            if unregister is not None:
+                unregister()
+
+
+def chat_completion(payload, sink=None, input_tokens=None):
+    """Run a chat completion and return the full text.
+
+    Identical requests are answered from the response cache unless it is
+    disabled; other requests first wait for a slot from the LLM scheduler.
+    If a sink is given, it is reset when the call starts (so a retried call
+    starts over) and receives every content delta through sink.write.
+    Only complete streams are cached. Timings (from admission) and token
+    counts are recorded in metrics; output tokens are counted as stream
+    deltas.
+    """
+    start = time.perf_counter()
+    cache = get_response_cache()
+    key = fingerprint(payload) if cache.enabled else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            if sink is not None:
+                sink.reset()
+                sink.write(cached)
+            metrics.record_llm_call(input_tokens, 0, time.perf_counter() - start, cache_hit=True)
+            return cached
+
+    pieces = []
+    ttft = None
+    decoder = SSEDecoder()
+    with admitted():
+        start = time.perf_counter()
+        if sink is not None:
+            sink.reset()
+        for delta in iter_chat_deltas(payload, decoder):
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            pieces.append(delta)
+            if sink is not None:
+                sink.write(delta)
+    response = ''.join(pieces)
+    metrics.record_llm_call(input_tokens, len(pieces), time.perf_counter() - start, ttft=ttft)
+
+    if not decoder.done:
+        logger.warning("Chat completion stream ended without [DONE]; not caching the response")
+    elif key is not None and response:
+        cache.put(key, response)
+    return response
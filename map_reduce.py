@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+
+import httpx
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from cancellation import Cancelled, DeadlineExceeded, check_cancelled, time_left
+from llm_scheduler import attempt_context
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+BACKOFF_POLL_SECONDS = 0.1  # How often a retry backoff checks for cancellation
+
+
+def is_retryable(error):
+    if isinstance(error, Cancelled):
+        return False
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRY_STATUS_CODES
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+async def cancellable_sleep(seconds):
+    # Retry backoff that ends as soon as the work is cancelled or out of time
+    until = time.monotonic() + seconds
+    while (left := until - time.monotonic()) > 0:
+        check_cancelled()
+        await asyncio.sleep(min(left, BACKOFF_POLL_SECONDS))
+    check_cancelled()
+
+
+def call_in_scope(fn, item, timeout, cost, on_admitted):
+    # Runs in the worker thread; the request's own scope (see llm_scheduler.admitted) closes the stream once
+    # the attempt times out, rather than leaving it running unread
+    with attempt_context(cost, timeout, on_admitted):
+        return fn(item)
+
+
+async def run_attempt(fn, item, timeout, cost):
+    # The attempt timeout starts when the scheduler admits the request, so queueing is not counted against
+    # it; a cache hit returns without ever being admitted
+    loop = asyncio.get_running_loop()
+    admitted = asyncio.Event()
+    call = asyncio.ensure_future(asyncio.to_thread(call_in_scope, fn, item, timeout, cost,
+                                                   lambda: loop.call_soon_threadsafe(admitted.set)))
+    waiting = asyncio.ensure_future(admitted.wait())
+    try:
+        await asyncio.wait({call, waiting}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        waiting.cancel()
+    try:
+        if call.done():
+            return call.result()
+        return await asyncio.wait_for(call, time_left(timeout))
+    except DeadlineExceeded:
+        # The attempt's own timeout ran out rather than the caller's deadline: retryable like any other timeout
+        check_cancelled()
+        raise asyncio.TimeoutError() from None
+
+
+class MapResult:
+    __slots__ = ('index', 'value', 'error', 'attempts')
+
+    def __init__(self, index, value=None, error=None, attempts=0):
+        self.index = index
+        self.value = value
+        self.error = error
+        self.attempts = attempts
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+async def _map_one(fn, index, item, semaphore, timeout, max_attempts, cost):
+    attempts = 0
+    tokens = cost(item) if cost is not None else 0
+    try:
+        async for attempt in AsyncRetrying(
+            retry=retry_if_exception(is_retryable),
+            wait=wait_random_exponential(multiplier=1, max=20),
+            stop=stop_after_attempt(max_attempts),
+            reraise=True,
+            sleep=cancellable_sleep,
+        ):
+            with attempt:
+                attempts += 1
+                # Hold the slots only while a request is in flight, not during backoff
+                async with semaphore:
+                    check_cancelled()
+                    value = await run_attempt(fn, item, time_left(timeout), tokens)
+        if attempts > 1:
+            metrics.increment("llm_retries_total", attempts - 1)
+        return MapResult(index, value=value, attempts=attempts)
+    except Cancelled as e:
+        metrics.increment("llm_cancelled_total")
+        logger.info(f"Item {index + 1} stopped: {str(e)}")
+        return MapResult(index, error=e, attempts=attempts)
+    except Exception as e:
+        metrics.increment("llm_retries_total", max(attempts - 1, 0))
+        metrics.increment("llm_failures_total")
+        logger.error(f"Item {index + 1} failed after {attempts} attempt(s): {str(e)}")
+        return MapResult(index, error=e, attempts=attempts)
+
+
+async def map_ordered_async(fn, items, concurrency=4, timeout=180, max_attempts=3, on_result=None, cost=None):
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [
+        asyncio.ensure_future(_map_one(fn, index, item, semaphore, timeout, max_attempts, cost))
+        for index, item in enumerate(items)
+    ]
+    if on_result is not None:
+        # Callbacks run on the event loop thread, i.e. the thread that called map_ordered
+        for task in tasks:
+            task.add_done_callback(lambda task: on_result(task.result()))
+    return await asyncio.gather(*tasks)
+
+
+def map_ordered(fn, items, concurrency=4, timeout=180, max_attempts=3, on_result=None, cost=None):
+    """Apply a blocking fn to every item with at most `concurrency` calls in flight.
+
+    Results come back in input order as MapResult objects. Failed items carry
+    their exception instead of a value, so callers decide how to handle
+    partial failure. 408/429/5xx responses and transport errors are retried
+    with jittered exponential backoff. on_result, if given, is called with
+    each MapResult as it completes.
+
+    Items stop with Cancelled once the caller's cancel_scope is cancelled or
+    past its deadline; attempt timeouts are shortened to fit the deadline.
+
+    Requests that are not answered from the response cache also wait for a
+    slot from the process-wide LLM scheduler, under the user and priority of
+    the caller's request_context; cost, if given, estimates the tokens an
+    item's request uses against the scheduler's tokens-per-minute budget.
+    """
+    return asyncio.run(map_ordered_async(fn, items, concurrency, timeout, max_attempts, on_result, cost))
+
+
+def call_with_retries(fn, *args, timeout=180, max_attempts=3, cost=0):
+    # Single-call form of map_ordered: same retry policy, but failures raise
+    result = map_ordered(lambda _: fn(*args), [None], concurrency=1, timeout=timeout, max_attempts=max_attempts,
+                         cost=lambda _: cost)[0]
+    if not result.ok:
+        raise result.error
+    return result.value
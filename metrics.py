@@ -0,0 +1,130 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_WINDOW = 1000  # Recent observations kept per series for percentiles
+
+
+class Series:
+    __slots__ = ('count', 'total', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=SAMPLE_WINDOW)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def percentile(self, q):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Metrics:
+    """Process-wide counters and timing series, exportable as Prometheus text or JSON lines.
+
+    Every observation is also appended to METRICS_LOG_PATH as one JSON line when
+    that environment variable is set.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.series = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def increment(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = Series()
+            series.observe(value)
+
+    def event(self, kind, **fields):
+        path = os.environ.get("METRICS_LOG_PATH")
+        if not path:
+            return
+        line = orjson.dumps({"ts": time.time(), "event": kind, **fields}) + b"\n"
+        try:
+            with self._lock, open(path, 'ab') as f:
+                f.write(line)
+        except OSError as e:
+            logger.warning(f"Could not write metrics event: {str(e)}")
+
+    @contextmanager
+    def stage(self, name, **fields):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("stage_seconds", elapsed, stage=name)
+            self.event("stage", stage=name, seconds=round(elapsed, 6), **fields)
+
+    def record_llm_call(self, input_tokens, output_tokens, seconds, ttft=None, cache_hit=False):
+        cache = "hit" if cache_hit else "miss"
+        self.increment("llm_calls_total", cache=cache)
+        self.increment("llm_input_tokens_total", input_tokens or 0)
+        self.increment("llm_output_tokens_total", output_tokens)
+        self.observe("llm_call_seconds", seconds, cache=cache)
+        if ttft is not None:
+            self.observe("llm_ttft_seconds", ttft)
+        if not cache_hit and seconds > 0:
+            self.observe("llm_tokens_per_second", output_tokens / seconds)
+        self.event("llm_call", input_tokens=input_tokens, output_tokens=output_tokens,
+                   seconds=round(seconds, 6), ttft=None if ttft is None else round(ttft, 6), cache_hit=cache_hit)
+
+    def snapshot(self):
+        with self._lock:
+            counters = [(name, dict(labels), value) for (name, labels), value in sorted(self.counters.items())]
+            series = [
+                (name, dict(labels), s.count, s.total, s.percentile(0.5), s.percentile(0.95))
+                for (name, labels), s in sorted(self.series.items(), key=lambda item: item[0])
+            ]
+        return counters, series
+
+    def to_prometheus(self):
+        counters, series = self.snapshot()
+        lines = []
+
+        def label_text(labels, extra=None):
+            items = sorted({**labels, **(extra or {})}.items())
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}" if items else ""
+
+        for name, labels, value in counters:
+            lines.append(f"bulletin_{name}{label_text(labels)} {value}")
+        for name, labels, count, total, p50, p95 in series:
+            lines.append(f"bulletin_{name}_count{label_text(labels)} {count}")
+            lines.append(f"bulletin_{name}_sum{label_text(labels)} {total:.6f}")
+            lines.append(f"bulletin_{name}{label_text(labels, {'quantile': '0.5'})} {p50:.6f}")
+            lines.append(f"bulletin_{name}{label_text(labels, {'quantile': '0.95'})} {p95:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.series.clear()
+
+
+metrics = Metrics()
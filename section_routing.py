@@ -0,0 +1,93 @@
+import threading
+
+import numpy as np
+
+from document_index import encode_normalized
+
+ROUTE_TOP_SENTENCES = 3  # A chunk's score for a section is the mean similarity of its best few sentences
+ROUTE_TOP_CHUNKS = 2  # Every section is asked of at least its best-scoring chunks
+ROUTE_MARGIN = 0.1  # ...and of any other chunk scoring within this of the best one
+ROUTE_MIN_SIMILARITY = 0.3  # ...and at least this (cosine, for all-MiniLM-L6-v2)
+
+_section_embeddings = {}
+_section_embeddings_lock = threading.Lock()
+
+
+def section_embeddings(embeddings_model, descriptions):
+    # Encoded once per model; the model is kept in the key's value so its id cannot be reused
+    key = (id(embeddings_model), tuple(descriptions))
+    with _section_embeddings_lock:
+        if key not in _section_embeddings:
+            _section_embeddings[key] = (embeddings_model, encode_normalized(embeddings_model, list(descriptions)))
+        return _section_embeddings[key][1]
+
+
+class SectionRouter:
+    """Picks, for each map chunk of a document, the bulletin sections worth asking the LLM about.
+
+    Chunks are scored against one embedding per section description through
+    the document's sentence embeddings (a SentenceIndex), so routing encodes
+    nothing beyond the section descriptions.
+    """
+
+    def __init__(self, sentence_index, section_embeddings):
+        self.sentence_index = sentence_index
+        self.section_embeddings = section_embeddings
+
+    @classmethod
+    def build(cls, sentence_index, embeddings_model, descriptions):
+        return cls(sentence_index, section_embeddings(embeddings_model, descriptions))
+
+    @property
+    def text(self):
+        return self.sentence_index.text
+
+    def part_sentences(self, char_offsets):
+        """Return, for each (start, end) part of the text, the indices of the sentences that overlap it.
+
+        A sentence that spans several parts counts towards each of them.
+        Parts must be sorted and not overlap one another.
+        """
+        offsets = np.asarray(char_offsets, dtype=np.int64).reshape(-1, 2)
+        spans = self.sentence_index.spans
+        # First part ending after the sentence starts, last part starting before it ends
+        first = np.searchsorted(offsets[:, 1], spans[:, 0], side='right')
+        last = np.searchsorted(offsets[:, 0], spans[:, 1], side='left') - 1
+        counts = np.maximum(last - first + 1, 0)
+        sentences = np.repeat(np.arange(len(spans)), counts)
+        parts = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        order = np.argsort(parts, kind='stable')
+        bounds = np.searchsorted(parts[order], np.arange(len(offsets) + 1))
+        return [sentences[order[bounds[i]:bounds[i + 1]]] for i in range(len(offsets))]
+
+    def scores(self, char_offsets):
+        """Return a (chunks, sections) array of how relevant each chunk of the text is to each section.
+
+        Chunks that no sentence overlaps (e.g. only whitespace) have no score and are NaN.
+        """
+        scores = np.full((len(char_offsets), len(self.section_embeddings)), np.nan, dtype=np.float32)
+        if not len(self.sentence_index) or not len(char_offsets):
+            return scores
+        # Embeddings are unit length, so the dot product is the cosine similarity
+        similarities = self.sentence_index.embeddings @ self.section_embeddings.T
+        for chunk, sentences in enumerate(self.part_sentences(char_offsets)):
+            if len(sentences):
+                top = min(ROUTE_TOP_SENTENCES, len(sentences))
+                scores[chunk] = np.partition(similarities[sentences], -top, axis=0)[-top:].mean(axis=0)
+        return scores
+
+    def route(self, char_offsets, top_chunks=ROUTE_TOP_CHUNKS, margin=ROUTE_MARGIN, min_similarity=ROUTE_MIN_SIMILARITY):
+        """Return the section indices to ask each chunk about; chunks with none can be skipped.
+
+        Chunks without a score are asked about every section rather than dropped.
+        """
+        scores = self.scores(char_offsets)
+        if not len(scores):
+            return []
+        scored = ~np.isnan(scores).any(axis=1)
+        ranked = np.where(scored[:, None], scores, -np.inf)
+        keep = (ranked >= ranked.max(axis=0) - margin) & (ranked >= min_similarity)
+        best = np.argsort(-ranked, axis=0, kind='stable')[:top_chunks]
+        keep[best, np.arange(scores.shape[1])] = True
+        keep[~scored] = True
+        return [np.flatnonzero(row).tolist() for row in keep]
@@ -0,0 +1,442 @@
+import logging
+import math
+import os
+import re
+import time
+
+import tiktoken
+
+from cancellation import cancel_scope, check_cancelled
+from llm_transport import chat_completion
+from map_reduce import call_with_retries, map_ordered
+from metrics import metrics
+from text_chunking import chunk_spans, chunk_text
+
+logger = logging.getLogger(__name__)
+
+tokenizer = tiktoken.get_encoding("cl100k_base")
+
+MODEL = "llama-3-8b-instruct"
+MAX_OUTPUT_TOKENS = 4000
+MAX_TOKENS = 8192  # Maximum tokens for the model
+BUFFER_TOKENS = 50  # Buffer for system message and other overhead
+REDUCE_ARITY = 4  # Map outputs combined per reduce call
+MAX_REDUCE_DEPTH = 3  # Reduce levels, including the final call
+REDUCE_OUTPUT_TOKENS = 1500  # Output budget for intermediate reduce calls
+REDUCE_INSTRUCTION_TOKENS = 500  # Tail of a non-bulletin prompt carried into reduce calls
+MAP_SYSTEM_MESSAGE = "You are a helpful AI assistant. Respond directly to the user without mentioning yourself in the third person or commenting on the nature of the response."
+MIN_SECTION_CHUNK_TOKENS = 1000  # Below this document budget per chunk, routed section extraction is not used
+ROUTE_PART_TOKENS = 512  # Size of the document parts routed to sections, then packed into map calls
+PART_SEPARATOR = "\n\n[...]\n\n"  # Between parts of a map call that are not adjacent in the document
+PART_SEPARATOR_TOKENS = 5
+MAX_CONTEXT_TOKENS = 300  # Retrieved context sentences placed ahead of the prompt
+REDUCE_SYSTEM_MESSAGE = "You are a helpful AI assistant. Combine the partial summaries into one response that follows the instructions. Keep every concrete fact, date and requirement; if no partial summary has information for a section, indicate it with 'Not applicable'."
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "4"))  # Max in-flight requests per summary
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "180"))  # Seconds per request
+LLM_MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", "3"))
+LLM_DEADLINE = float(os.environ.get("LLM_DEADLINE", "900"))  # Seconds for a whole summary or answer, across all its calls
+
+# Bulletin section instructions, also carried into every reduce call
+PROMPT_INSTRUCTIONS = """
+    Please provide a comprehensive summary for a bulletin based on these factors. Pretend that you are a regulatory engineer whose job is to interpret this document into an internal regulatory bulletin for engineers to follow some important compliance guidance. Do not focus on punishments or penalties. Please provide the summary with all the following sections, and all of them should be filled in with corresponding information:
+    1) Program Requirements Summary: a 2-3 sentence, brief summary of the regulation.
+    2) Regulation Publication Date: the date the regulation was published. If regulation has not been published, leave this blank.
+    3) Enforcement Date: This is the effective date of the regulation.
+    4) Enforcement based on: Type of enforcement
+    5) Compliance Checkpoint: How is regulation enforced upon entry?
+    6) Regulation Status: Type of Regulation Status
+    7) What is current process: If a regulation revision, this will be a 2-3 sentence summary of the current process, if it is a new regulation, note that it is new
+    8) What has changed from current process:  2-3 sentence summary of what is changing from existing regulation process.  This section is what is used for Bulletin email summaries. Character limit has been increased to 1000. Must ensure Summary in properties reflects same as Bulletin
+    9) Key Details – Legislation Requirement: This section is the regulation requirements. What is needed to reach compliance.
+    10) Requirement: Frequently used Requirements are listed in the table template, add additional requirements as required, and delete those not relevant.
+    11) Dependency: Is the requirement dependent on another requirement in the table? If so, list the requirement that must be completed to meet the requirement.
+    12) Details of Requirement: High level explanation of the regulatory requirement
+    13) Wireless Technology Scope: For Wireless Programs only, leave blank if not related
+    14) Detail Requirements: This is details of Regulation.  May include some tables and technical detail copied from regulation.  Should not, however be a straight copy/paste.
+    """
+# One line per bulletin section, in the order of bulletin_sections.SECTIONS; also what chunks are routed by
+SECTION_INSTRUCTIONS = re.findall(r'^\s*\d+\) (.+)$', PROMPT_INSTRUCTIONS, re.MULTILINE)
+SECTION_MAP_INSTRUCTIONS = (
+    "You are a regulatory engineer interpreting a regulation into an internal regulatory bulletin for engineers. "
+    "Below is one part of the regulation. Fill in only the sections listed, from this part alone. "
+    "Do not focus on punishments or penalties."
+)
+CONSIDERATIONS_HEADING = "Please summarize the attached document with the following considerations:\n\n"
+DOCUMENT_MARKER = "following attached file content:\n\n"  # Separates the prompt header from the document
+
+def build_guided_prompt(guided_questions, guided_answers, keyword_index=None, similar_bulletins=(), suggested_keywords=None):
+    """Build the summary prompt and its markdown rendering from the guided answers.
+
+    guided_answers maps question text to the answer string. suggested_keywords
+    are keywords already chosen for the document (KeywordEmbeddings.suggest);
+    if None, keyword_index, a KeywordIndex over past bulletins, fuzzy-matches
+    them against the prompt. similar_bulletins are the file names of the
+    closest prior bulletins, if any.
+    """
+    suggested_prompt = CONSIDERATIONS_HEADING
+    formatted_prompt = "Summary of your inputs:\n\n"
+    
+    for section, data in guided_questions.items():
+        suggested_prompt += f"{section}:\n"
+        formatted_prompt += f"**{section}:**\n"
+        for question in data.get('questions', []):
+            question_text = question.get('question', '')
+            answer = guided_answers.get(question_text, '')
+            
+            suggested_prompt += f"- {question_text}: {answer}\n"
+            formatted_prompt += f"- {question_text}: {answer}\n"
+            
+            # Handle follow-up questions for yes/no questions
+            if question.get('type') == 'Yes/No' and answer.lower() in ['yes', 'no']:
+                for follow_up in question.get('follow_up', []):
+                    if follow_up['condition'].lower() == answer.lower():
+                        follow_up_answer = guided_answers.get(follow_up['question'], '')
+                        suggested_prompt += f"  - {follow_up['question']}: {follow_up_answer}\n"
+                        formatted_prompt += f"  - {follow_up['question']}: {follow_up_answer}\n"
+        
+        suggested_prompt += "\n"
+        formatted_prompt += "\n"
+
+    # Add keywords suggested from similar past bulletins, or fuzzy matched against the prompt
+    keywords = suggested_keywords
+    if keywords is None:
+        keywords = keyword_index.match(suggested_prompt) if keyword_index is not None else ""
+    if keywords:
+        suggested_prompt += f"\nRelevant Keywords: {keywords}\n\n"
+
+    # Add the most similar prior bulletins from the corpus index
+    if similar_bulletins:
+        suggested_prompt += f"Similar Prior Bulletins: {', '.join(similar_bulletins)}\n\n"
+
+    suggested_prompt += PROMPT_INSTRUCTIONS
+    formatted_prompt += "**Instructions for the AI:**\n" + PROMPT_INSTRUCTIONS
+
+    return suggested_prompt, formatted_prompt
+
+def build_summary_prompt(suggested_prompt, document, context=""):
+    context = truncate_tokens(context, MAX_CONTEXT_TOKENS) if context else context
+    full_prompt = f"{suggested_prompt}\n\nPlease provide a summary based on the above considerations and the {DOCUMENT_MARKER}{document}"
+    return f"Context: {context}\n\n{full_prompt}"
+
+def count_tokens(text):
+    return len(tokenizer.encode(text))
+
+def smart_chunk_prompt(prompt, max_tokens=4000, overlap=0):
+    with metrics.stage("chunking"):
+        return chunk_text(prompt, tokenizer, max_tokens=max_tokens, overlap=overlap)
+
+def add_instructions_to_chunk(chunk, original_prompt):
+    # Only the instructions travel with later chunks (for chat prompts, the question at the end), never
+    # the rest of the prompt: the first chunk already holds its header, and the document is being chunked
+    instructions = get_reduce_instructions(original_prompt).strip()
+
+    chunk_with_instructions = f"""
+    Instructions:
+    {instructions}
+
+    Note: This is a part of a larger document. For any sections where information is not available in this chunk, please write 'Information not available in this chunk.'
+
+    Chunk content:
+    {chunk}
+    """
+
+    return chunk_with_instructions.strip()
+
+def process_chunk(chunk, chunk_num, total_chunks, original_prompt, sink=None, structured=False):
+    if chunk_num > 1:
+        chunk_with_instructions = add_instructions_to_chunk(chunk, original_prompt)
+    else:
+        chunk_with_instructions = chunk
+    if structured:
+        from bulletin_sections import JSON_INSTRUCTIONS
+        chunk_with_instructions += f"\n\n{JSON_INSTRUCTIONS}"
+
+    logger.debug(f"Processing chunk {chunk_num} of {total_chunks}")
+    return complete_map_prompt(chunk_with_instructions, sink)
+
+def complete_map_prompt(content, sink=None):
+    messages = [
+        {"role": "system", "content": MAP_SYSTEM_MESSAGE},
+        {"role": "user", "content": content}
+    ]
+    
+    data = {
+        "model": MODEL,  
+        "messages": messages,
+        "temperature": 0.4,
+        "top_p": 0.95,
+        "max_tokens": MAX_OUTPUT_TOKENS
+    }
+    
+    input_tokens = count_tokens(MAP_SYSTEM_MESSAGE) + count_tokens(content)
+    return chat_completion(data, sink, input_tokens=input_tokens)
+
+def map_llm_calls(fn, items, on_progress=None, cost=None):
+    start_time = time.perf_counter()
+    progress = {"done": 0, "tokens": 0}
+
+    def report(result):
+        progress["done"] += 1
+        if result.ok:
+            progress["tokens"] += count_tokens(result.value)
+        if on_progress is not None:
+            on_progress(progress["done"], len(items), progress["tokens"], time.perf_counter() - start_time)
+
+    results = map_ordered(
+        fn,
+        items,
+        concurrency=LLM_CONCURRENCY,
+        timeout=LLM_TIMEOUT,
+        max_attempts=LLM_MAX_ATTEMPTS,
+        on_result=report,
+        cost=cost,
+    )
+    # A cancelled or timed-out summary stops here rather than reducing what it has
+    check_cancelled()
+    failed = [result.index + 1 for result in results if not result.ok]
+    if len(failed) == len(results):
+        raise RuntimeError(f"All {len(results)} calls failed: {str(results[0].error)}")
+    if failed:
+        logger.warning(f"Continuing without parts {failed} of {len(results)} after repeated failures")
+    return [result.value for result in results if result.ok]
+
+def process_chunks_parallel(chunks, original_prompt, on_progress=None, structured=False):
+    return map_llm_calls(
+        lambda item: process_chunk(item[1], item[0] + 1, len(chunks), original_prompt, structured=structured),
+        list(enumerate(chunks)),
+        on_progress,
+        # Estimated tokens for the scheduler's budget: endpoints count max_tokens against it, not the reply
+        cost=lambda item: count_tokens(item[1]) + MAX_OUTPUT_TOKENS,
+    )
+
+def answered_considerations(header):
+    # The guided answers the user gave, without unanswered questions, keywords or section instructions
+    start = header.find(CONSIDERATIONS_HEADING)
+    end = header.find(PROMPT_INSTRUCTIONS)
+    if start < 0 or end < start:
+        return []
+    lines = header[start + len(CONSIDERATIONS_HEADING):end].split("\n")
+    return [line for line in lines if line.lstrip().startswith("- ") and not line.rstrip().endswith(":")]
+
+def build_section_prompt(chunk, considerations, sections):
+    # Map prompt asking one part of the document about the given bulletin sections (indices into SECTIONS) only
+    from bulletin_sections import SECTIONS, json_instructions
+    answers = "".join(f"{line.strip()}\n" for line in considerations)
+    if answers:
+        answers = f"\nThe user's answers about this regulation:\n{answers}"
+    lines = "\n".join(f"{i + 1}) {SECTION_INSTRUCTIONS[i]}" for i in sections)
+    return (f"{SECTION_MAP_INSTRUCTIONS}\n{answers}\nSections:\n{lines}\n\nPart of the document:\n{chunk}\n\n"
+            f"{json_instructions(SECTIONS[i][0] for i in sections)}")
+
+def route_sections(document, offsets, router=None):
+    # Section indices to ask about for each (start, end) part of the document; all of them without a router
+    everything = list(range(len(SECTION_INSTRUCTIONS)))
+    if router is None or router.text != document:
+        return [everything for _ in offsets]
+    return router.route(offsets)
+
+def pack_parts_by_section(parts, routes, budget):
+    # Relevant parts share a map call, in document order, up to budget tokens; it is asked about all their sections
+    groups = []
+    offsets, sections, tokens = [], set(), 0
+    for (start, end, part_tokens), part_sections in zip(parts, routes):
+        if not part_sections:
+            continue
+        if offsets and tokens + part_tokens > budget:
+            groups.append((offsets, sorted(sections)))
+            offsets, sections, tokens = [], set(), 0
+        offsets.append((start, end))
+        sections.update(part_sections)
+        tokens += part_tokens + PART_SEPARATOR_TOKENS
+    if offsets:
+        groups.append((offsets, sorted(sections)))
+    return groups
+
+def map_sections(prompt, router=None, on_progress=None):
+    """Map step for bulletin summaries: ask each part of the document only about the sections it is relevant to.
+
+    The first chunk of the document is sent with the whole prompt header
+    (context, guided answers, keywords, every section). The rest is split
+    into ROUTE_PART_TOKENS parts, which the router scores against the
+    section descriptions; parts relevant to no section are skipped and the
+    others are packed into map calls that carry only the user's answers
+    and their sections. Without a router every part is kept and asked about
+    every section. Returns None if the prompt has no attached document or
+    too little room for one.
+    """
+    from bulletin_sections import JSON_INSTRUCTIONS
+
+    header, marker, document = prompt.partition(DOCUMENT_MARKER)
+    header += marker
+    considerations = answered_considerations(header)
+    available = MAX_TOKENS - count_tokens(MAP_SYSTEM_MESSAGE) - MAX_OUTPUT_TOKENS - BUFFER_TOKENS
+    first_budget = available - count_tokens(header) - count_tokens(JSON_INSTRUCTIONS)
+    budget = available - count_tokens(build_section_prompt("", considerations, range(len(SECTION_INSTRUCTIONS))))
+    if not marker or first_budget < MIN_SECTION_CHUNK_TOKENS:
+        return None
+    with metrics.stage("chunking"):
+        # Tokenizing a generous prefix is enough to find where the first chunk ends
+        first = chunk_spans(document[:first_budget * 16], tokenizer, max_tokens=first_budget)[0]
+        parts = [(first.end + span.start, first.end + span.end, span.token_count)
+                 for span in chunk_spans(document[first.end:], tokenizer, max_tokens=ROUTE_PART_TOKENS)]
+
+    routes = route_sections(document, [(start, end) for start, end, _ in parts], router)
+    groups = pack_parts_by_section(parts, routes, budget)
+    contents = [f"{header}{document[first.start:first.end]}\n\n{JSON_INSTRUCTIONS}"]
+    contents += [build_section_prompt(PART_SEPARATOR.join(document[start:end] for start, end in offsets), considerations, sections)
+                 for offsets, sections in groups]
+    skipped = sum(not sections for sections in routes)
+    logger.info(f"Document split into a first chunk and {len(parts)} parts; {skipped} parts relevant to no section "
+                f"were skipped, the rest packed into {len(groups)} map calls")
+    metrics.increment("map_parts_skipped_total", skipped)
+    return map_llm_calls(complete_map_prompt, contents, on_progress,
+                         cost=lambda content: count_tokens(content) + MAX_OUTPUT_TOKENS)
+
+def process_summary_chunk(chunk, instructions, max_tokens, sink=None):
+    # Only the section instructions travel with each reduce call, never the source document
+    summary_prompt = f"{instructions}\n\nPlease combine the following partial summaries into a single response that follows the instructions provided above:\n\n{chunk}"
+
+    messages = [
+        {"role": "system", "content": REDUCE_SYSTEM_MESSAGE},
+        {"role": "user", "content": summary_prompt}
+    ]
+
+    data = {
+        "model": MODEL,  
+        "messages": messages,
+        "temperature": 0.4,
+        "top_p": 0.95,
+        "max_tokens": max_tokens
+    }
+
+    input_tokens = count_tokens(REDUCE_SYSTEM_MESSAGE) + count_tokens(summary_prompt)
+    return chat_completion(data, sink, input_tokens=input_tokens)
+
+def get_reduce_instructions(original_prompt):
+    if PROMPT_INSTRUCTIONS in original_prompt:
+        return PROMPT_INSTRUCTIONS
+    # Chat prompts end with the user's question; keep just that tail
+    return tokenizer.decode(tokenizer.encode_ordinary(original_prompt)[-REDUCE_INSTRUCTION_TOKENS:])
+
+def truncate_tokens(text, max_tokens):
+    tokens = tokenizer.encode_ordinary(text)
+    return text if len(tokens) <= max_tokens else tokenizer.decode(tokens[:max_tokens])
+
+def pack_parts(parts, budget):
+    # Split the budget evenly; parts under their share are kept whole
+    per_part = budget // max(len(parts), 1)
+    return "\n\n".join(text if tokens <= per_part else truncate_tokens(text, per_part) for text, tokens in parts)
+
+def summarize_responses(responses, original_prompt, sink=None, on_progress=None):
+    """Reduce map outputs with a fixed-arity tree of at most MAX_REDUCE_DEPTH levels.
+
+    Every reduce call gets the same hard input budget, split evenly between
+    its children, so each level costs at most its number of groups times
+    MAX_TOKENS and the total work stays linear in the number of map outputs.
+    """
+    instructions = get_reduce_instructions(original_prompt)
+    overhead = count_tokens(REDUCE_SYSTEM_MESSAGE) + count_tokens(instructions) + BUFFER_TOKENS
+    final_budget = MAX_TOKENS - overhead - MAX_OUTPUT_TOKENS
+    level_budget = MAX_TOKENS - overhead - REDUCE_OUTPUT_TOKENS
+
+    parts = [(response, count_tokens(response)) for response in responses]
+    for level in range(MAX_REDUCE_DEPTH - 1):
+        if sum(tokens for _, tokens in parts) <= final_budget:
+            break
+
+        # Widen the fan-in only if the depth bound would otherwise be exceeded
+        remaining_levels = MAX_REDUCE_DEPTH - level
+        arity = max(REDUCE_ARITY, math.ceil(len(parts) ** (1 / remaining_levels)))
+        groups = [parts[i:i + arity] for i in range(0, len(parts), arity)]
+        logger.info(f"Reduce level {level + 1}: {len(parts)} parts in {len(groups)} groups")
+
+        summaries = map_llm_calls(
+            lambda text: process_summary_chunk(text, instructions, REDUCE_OUTPUT_TOKENS),
+            [pack_parts(group, level_budget) for group in groups],
+            on_progress,
+            cost=lambda text: overhead + count_tokens(text) + REDUCE_OUTPUT_TOKENS,
+        )
+        parts = [(summary, count_tokens(summary)) for summary in summaries]
+
+    final_input = pack_parts(parts, final_budget)
+    return call_with_retries(process_summary_chunk, final_input, instructions, MAX_OUTPUT_TOKENS, sink, timeout=LLM_TIMEOUT, max_attempts=LLM_MAX_ATTEMPTS,
+                             cost=overhead + count_tokens(final_input) + MAX_OUTPUT_TOKENS)
+
+def reduce_narrative_sections(pending, sink=None):
+    # One LLM call for every narrative section that still has conflicting candidates; sink receives the raw JSON reply
+    from bulletin_sections import parse_sections
+
+    instructions = (
+        f"{PROMPT_INSTRUCTIONS}\n\nEach section below has several partial answers taken from different parts of the document. "
+        "Merge them into one answer per section. Respond only with a single JSON object using exactly these keys: "
+        + ", ".join(f'"{name}"' for name in pending) + "."
+    )
+    budget = MAX_TOKENS - count_tokens(REDUCE_SYSTEM_MESSAGE) - count_tokens(instructions) - MAX_OUTPUT_TOKENS - BUFFER_TOKENS
+    per_section = budget // len(pending)
+    sections_text = "\n\n".join(
+        f"{name}:\n" + pack_parts([(candidate, count_tokens(candidate)) for candidate in candidates], per_section)
+        for name, candidates in pending.items()
+    )
+    response = call_with_retries(process_summary_chunk, sections_text, instructions, MAX_OUTPUT_TOKENS, sink, timeout=LLM_TIMEOUT, max_attempts=LLM_MAX_ATTEMPTS,
+                                 cost=MAX_TOKENS - budget + count_tokens(sections_text))
+
+    reduced = parse_sections(response)
+    reduced = reduced.by_section() if reduced is not None else {}
+    # Fall back to the candidates in document order for anything the model left out
+    return {name: reduced.get(name) or "\n\n".join(candidates) for name, candidates in pending.items()}
+
+def summarize_structured(responses, prompt, sink=None, on_progress=None):
+    # pydantic is only needed here, so it stays out of the app's startup imports
+    from bulletin_sections import SectionStream, merge_sections, parse_sections, render_sections
+    extractions = [parse_sections(response) for response in responses]
+    unparsed = sum(extraction is None for extraction in extractions)
+    if unparsed:
+        logger.warning(f"{unparsed} of {len(responses)} chunk replies were not valid section JSON; using free-text reduce")
+        return summarize_responses(responses, prompt, sink, on_progress)
+
+    merged, pending = merge_sections(extractions)
+    logger.info(f"Merged {len(merged) - len(pending)} sections locally; {len(pending)} narrative sections need a reduce call")
+    # Sections are streamed in bulletin order: merged ones now, narrative ones as the reduce writes them
+    stream = SectionStream(sink, merged, pending) if sink is not None else None
+    if pending:
+        merged.update(reduce_narrative_sections(pending, stream))
+
+    final_response = render_sections(merged)
+    if sink is not None and final_response != stream.text:
+        # The reduce left sections out or was not valid JSON; show the fallback text
+        sink.reset()
+        sink.write(final_response)
+    return final_response
+
+def get_model_response(model, prompt, sink=None, on_progress=None, router=None):
+    """Answer prompt with one call, or with map calls over its chunks and a reduce.
+
+    router, a SectionRouter over the attached document, limits which
+    bulletin sections each chunk of a bulletin summary is asked about.
+    """
+    max_chunk_tokens = MAX_TOKENS - count_tokens(MAP_SYSTEM_MESSAGE) - MAX_OUTPUT_TOKENS - BUFFER_TOKENS
+
+    # The deadline covers every map and reduce call of this response, including retries and queueing
+    with cancel_scope(LLM_DEADLINE):
+        if count_tokens(prompt) > max_chunk_tokens:
+            structured = PROMPT_INSTRUCTIONS in prompt
+            with metrics.stage("map"):
+                # Bulletin summaries ask chunks for per-section JSON, merged locally where possible
+                responses = map_sections(prompt, router, on_progress) if structured else None
+                if responses is None:
+                    # Later chunks also carry the instructions, so leave room for them
+                    chunks = smart_chunk_prompt(prompt, max_chunk_tokens - count_tokens(add_instructions_to_chunk("", prompt)))
+                    logger.info(f"Input split into {len(chunks)} chunks for processing.")
+                    responses = process_chunks_parallel(chunks, prompt, on_progress, structured=structured)
+            with metrics.stage("reduce", parts=len(responses)):
+                if structured:
+                    final_response = summarize_structured(responses, prompt, sink, on_progress)
+                else:
+                    final_response = summarize_responses(responses, prompt, sink, on_progress)
+        else:
+            # Single call: stream tokens straight to the sink as they arrive
+            with metrics.stage("single_call"):
+                final_response = call_with_retries(process_chunk, prompt, 1, 1, prompt, sink, timeout=LLM_TIMEOUT, max_attempts=LLM_MAX_ATTEMPTS,
+                                                   cost=count_tokens(prompt) + MAX_OUTPUT_TOKENS)
+    
+    return final_response
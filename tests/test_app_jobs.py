@@ -0,0 +1,49 @@
+import os
+import sys
+import time
+
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cancellation import check_cancelled
+from job_queue import CANCELLED, RUNNING, get_job_queue
+
+
+def generate_until_cancelled(sink=None, on_progress=None):
+    # Stands in for a summary that is still streaming: runs until its job is cancelled
+    while True:
+        check_cancelled()
+        sink.write(".")
+        time.sleep(0.01)
+
+
+def wait_for_status(job_id, status, timeout=5):
+    deadline = time.monotonic() + timeout
+    while get_job_queue().get(job_id).status != status and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return get_job_queue().get(job_id).status
+
+
+def test_start_new_analysis_cancels_running_job(monkeypatch):
+    monkeypatch.chdir(ROOT)  # The app loads its images relative to the working directory
+    job_id = get_job_queue().submit("summary", generate_until_cancelled, formatted_prompt="", document="text", guided_answers={})
+    assert wait_for_status(job_id, RUNNING) == RUNNING
+
+    at = AppTest.from_file(os.path.join(ROOT, "app_st.py"), default_timeout=60)
+    at.session_state["file_uploaded"] = True
+    at.session_state["prompt_ready"] = True
+    at.session_state["attached_file_content"] = "text"
+    at.session_state["summary_generated"] = True
+    at.session_state["current_conversation"] = "Chat 1"
+    at.session_state["conversations"] = {"Chat 1": []}
+    at.session_state["summary_job"] = job_id
+    at.run()
+    assert not at.exception
+
+    at.button(key="start_new_analysis").click().run()
+
+    assert wait_for_status(job_id, CANCELLED) == CANCELLED
+    assert at.session_state["file_uploaded"] is False
+    assert at.session_state["summary_job"] is None
@@ -0,0 +1,103 @@
+import re
+from bisect import bisect_left
+
+import numpy as np
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?]) +')
+
+
+class TextSpan:
+    """A chunk of a source string, kept as offsets until the text is actually needed."""
+
+    __slots__ = ('source', 'start', 'end', 'token_start', 'token_end')
+
+    def __init__(self, source, start, end, token_start, token_end):
+        self.source = source
+        self.start = start
+        self.end = end
+        self.token_start = token_start
+        self.token_end = token_end
+
+    @property
+    def token_count(self):
+        return self.token_end - self.token_start
+
+    def __str__(self):
+        return self.source[self.start:self.end]
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return f"TextSpan(chars={self.start}:{self.end}, tokens={self.token_start}:{self.token_end})"
+
+
+def token_char_offsets(text, tokenizer):
+    # One encode over the whole text; token byte lengths are mapped to character
+    # offsets by counting UTF-8 lead bytes, without a per-token Python loop
+    tokens = tokenizer.encode_ordinary(text)
+    token_lengths = np.fromiter(map(len, tokenizer.decode_tokens_bytes(tokens)), dtype=np.int64, count=len(tokens))
+    byte_starts = np.zeros(len(tokens), dtype=np.int64)
+    np.cumsum(token_lengths[:-1], out=byte_starts[1:])
+
+    data = np.frombuffer(text.encode('utf-8'), dtype=np.uint8)
+    chars_before = np.zeros(len(data) + 1, dtype=np.int64)
+    np.cumsum((data & 0xC0) != 0x80, out=chars_before[1:])
+    return tokens, chars_before[byte_starts]
+
+
+def sentence_token_boundaries(text, offsets):
+    # Token index at which each sentence starts, found by binary search on the token offsets
+    sentence_starts = [match.start() for match in SENTENCE_BOUNDARY.finditer(text)]
+    boundaries = np.unique(np.searchsorted(offsets, sentence_starts))
+    return boundaries[boundaries > 0].tolist()
+
+
+def chunk_spans(text, tokenizer, max_tokens=4000, overlap=0):
+    """Split text into spans of at most max_tokens tokens, preferring sentence boundaries.
+
+    The text is tokenized once. Sentences longer than the budget are cut at
+    the token limit, and consecutive spans share up to `overlap` tokens.
+    """
+    if max_tokens <= 0:
+        raise ValueError("max_tokens must be positive")
+    overlap = max(0, min(overlap, max_tokens - 1))
+
+    tokens, offsets = token_char_offsets(text, tokenizer)
+    total = len(tokens)
+    if total == 0:
+        return [TextSpan(text, 0, len(text), 0, 0)] if text else []
+
+    boundaries = sentence_token_boundaries(text, offsets)
+    spans = []
+    start = 0
+    boundary = 0  # Pointer into boundaries; only ever moves forward
+
+    while start < total:
+        limit = start + max_tokens
+        if limit >= total:
+            end = total
+        else:
+            while boundary < len(boundaries) and boundaries[boundary] <= limit:
+                boundary += 1
+            # Last sentence start that fits, or a hard cut for an over-long sentence
+            end = boundaries[boundary - 1] if boundary > 0 and boundaries[boundary - 1] > start else limit
+
+        char_end = int(offsets[end]) if end < total else len(text)
+        spans.append(TextSpan(text, int(offsets[start]), char_end, start, end))
+        if end == total:
+            break
+
+        next_start = end - overlap
+        if overlap:
+            # Snap the overlap forward to a sentence start when one is available
+            snap = bisect_left(boundaries, next_start)
+            if snap < len(boundaries) and boundaries[snap] < end:
+                next_start = boundaries[snap]
+        start = max(next_start, start + 1)
+
+    return spans
+
+
+def chunk_text(text, tokenizer, max_tokens=4000, overlap=0):
+    return [str(span) for span in chunk_spans(text, tokenizer, max_tokens, overlap)]